@@ -0,0 +1,77 @@
+"""
+Batch mutation benchmark.
+
+Deletes and updates N questions through the per-row endpoints (one HTTP
+call and one commit per id) and through the batch endpoints (one call,
+one transaction), against a throwaway SQLite database by default.
+
+    python -m benchmarks.bench_batch_mutations [count] [database_url]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import migrations
+from flaskr import create_app, stats
+from models import setup_db, db, Question, Category
+
+
+def seed(app, count):
+    with app.app_context():
+        migrations.upgrade(db.engine)
+        if Category.query.count() == 0:
+            db.session.execute(Category.__table__.insert(), [
+                {'id': 1, 'type': 'Science'}, {'id': 2, 'type': 'Art'}])
+        db.session.execute(Question.__table__.insert(), [
+            {'question': 'Benchmark question %d?' % number,
+             'answer': 'Answer', 'category': 1, 'difficulty': 1}
+            for number in range(count)])
+        db.session.commit()
+        stats.repair()
+        return [question_id for question_id, in db.session.query(
+            Question.id).order_by(Question.id.desc()).limit(count)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    directory = tempfile.mkdtemp()
+    database_url = sys.argv[2] if len(sys.argv) > 2 else \
+        'sqlite:///' + os.path.join(directory, 'bench.db')
+
+    app = create_app(active=False, test_config={'RESPONSE_CACHE': 'none'})
+    setup_db(app, database_url)
+    client = app.test_client()
+
+    ids = seed(app, count)
+    # There is no single-question update endpoint, so the per-row update
+    # path is one single-id batch call (and commit) per question.
+    per_row_update = timed(lambda: [
+        client.post('/questions/batch-update', json={
+            'ids': [question_id], 'set': {'difficulty': 2}})
+        for question_id in ids])
+    batch_update = timed(lambda: client.post('/questions/batch-update', json={
+        'ids': ids, 'set': {'difficulty': 3}}))
+
+    per_row_delete = timed(lambda: [
+        client.delete('/questions/%d' % question_id) for question_id in ids])
+    ids = seed(app, count)
+    batch_delete = timed(lambda: client.post(
+        '/questions/batch-delete', json={'ids': ids}))
+
+    print('%d questions' % count)
+    print('%-8s %14s %14s %9s' % ('', 'per-row (ms)', 'batch (ms)', 'speedup'))
+    for name, per_row, batched in (('update', per_row_update, batch_update),
+                                   ('delete', per_row_delete, batch_delete)):
+        print('%-8s %14.1f %14.1f %8.1fx' % (
+            name, per_row * 1e3, batched * 1e3, per_row / batched))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Thundering herd benchmark for request coalescing.
+
+Releases bursts of concurrent clients at the same instant against one
+GET route of a threaded WSGI server, as happens when a quiz event starts,
+once with coalescing off and once with it on. The response cache is
+disabled so every request that is not coalesced reaches the database.
+Reports SQL statements per burst, coalesced requests and latency.
+
+    python -m benchmarks.dataset sqlite:///bench.db --size 100k
+    python -m benchmarks.bench_coalesce sqlite:///bench.db
+"""
+import argparse
+import http.client
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import setup_db, db
+
+PATHS = ['/categories', '/categories/1/questions']
+
+
+def herd(port, path, clients):
+    barrier = threading.Barrier(clients)
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except OSError:
+            status = 599
+        finally:
+            conn.close()
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            failures[0] += status != 200
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return latencies, failures[0]
+
+
+def run(database_url, coalesced, clients, bursts):
+    app = create_app(active=False, test_config={
+        'RESPONSE_CACHE': 'none', 'COALESCE': coalesced})
+    setup_db(app, database_url)
+    app.logger.setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with app.app_context():
+        engine = db.engine
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    event.listen(engine, 'after_cursor_execute', count)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    # The whole herd connects at once; don't let the backlog drop it.
+    server.socket.listen(clients)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for path in PATHS:
+            statements[0] = 0
+            single_flight = app.extensions['trivia.coalesce']
+            followers = single_flight.stats()['followers']
+            latencies, failures = [], 0
+            for _ in range(bursts):
+                burst, failed = herd(server.server_port, path, clients)
+                latencies.extend(burst)
+                failures += failed
+            latencies.sort()
+            print('%-26s %-4s %10.1f %10.1f %10.2f %10.2f %8d' % (
+                path, 'on' if coalesced else 'off',
+                statements[0] / float(bursts),
+                (single_flight.stats()['followers'] - followers) /
+                float(bursts),
+                latencies[len(latencies) // 2] * 1e3,
+                latencies[int(len(latencies) * 0.95)] * 1e3, failures))
+    finally:
+        server.shutdown()
+        event.remove(engine, 'after_cursor_execute', count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('database_url')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--bursts', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-26s %-4s %10s %10s %10s %10s %8s' % (
+        'route', 'coal', 'sql/burst', 'shared', 'p50 (ms)', 'p95 (ms)',
+        'failed'))
+    for coalesced in (False, True):
+        run(args.database_url, coalesced, args.clients, args.bursts)
+
+
+if __name__ == '__main__':
+    main()
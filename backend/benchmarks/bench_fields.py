@@ -0,0 +1,83 @@
+"""
+Listing serialization benchmark.
+
+Compares how fast question rows are read and turned into JSON:
+    orm       Question entities and Question.format(), the old path
+    columns   column tuples and fields.serialize(), every field
+    sparse    column tuples of id, question, category and difficulty,
+              as in ?fields=question,category,difficulty
+Reports rows per second and bytes of JSON per row for each, then the same
+for GET /questions pages of 100 through the test client.
+
+    python -m benchmarks.dataset sqlite:///bench.db --size 100k
+    python -m benchmarks.bench_fields sqlite:///bench.db
+"""
+import argparse
+import json
+import time
+
+from flaskr import create_app, fields
+from models import setup_db, db, Question
+
+SPARSE = ('id', 'question', 'category', 'difficulty')
+REPEAT = 3
+PAGES = 50
+
+
+def orm(rows):
+    return [question.format() for question in
+            Question.query.order_by(Question.id).limit(rows)]
+
+
+def columns(rows, selected=fields.QUESTION_FIELDS):
+    return fields.serialize(
+        fields.select(selected).order_by(Question.id).limit(rows), selected)
+
+
+def timed(serialize, rows):
+    best, size = float('inf'), 0
+    for _ in range(REPEAT):
+        db.session.remove()
+        start = time.perf_counter()
+        payload = json.dumps(serialize(rows))
+        best = min(best, time.perf_counter() - start)
+        size = len(payload)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('database_url')
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    app = create_app(active=False, test_config={
+        'RESPONSE_CACHE': 'none', 'COALESCE': False})
+    setup_db(app, args.database_url)
+
+    print('%-10s %14s %12s' % ('path', 'rows/s', 'bytes/row'))
+    with app.app_context():
+        for name, serialize in [
+                ('orm', orm), ('columns', columns),
+                ('sparse', lambda rows: columns(rows, SPARSE))]:
+            seconds, size = timed(serialize, args.rows)
+            print('%-10s %14.0f %12.1f' % (
+                name, args.rows / seconds, size / float(args.rows)))
+
+    client = app.test_client()
+    print('\n%-44s %10s %12s' % ('GET', 'ms/page', 'bytes/page'))
+    for path in ['/questions?limit=100&count=none',
+                 '/questions?limit=100&count=none'
+                 '&fields=question,category,difficulty']:
+        sizes = []
+        start = time.perf_counter()
+        for page in range(1, PAGES + 1):
+            sizes.append(len(client.get('%s&page=%d' % (path, page)).data))
+        elapsed = time.perf_counter() - start
+        print('%-56s %10.2f %12.0f' % (
+            path[len('/questions?'):], elapsed / PAGES * 1e3,
+            sum(sizes) / float(PAGES)))
+
+
+if __name__ == '__main__':
+    main()
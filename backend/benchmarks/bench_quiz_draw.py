@@ -0,0 +1,58 @@
+"""
+Quiz draw benchmark.
+
+Compares DrawIndex.draw against the old approach of materializing every
+remaining candidate and calling random.choice, for pools of 1k to 1M
+questions spread over six categories.
+
+    python -m benchmarks.bench_quiz_draw
+"""
+import random
+import time
+
+from flaskr.draw import DrawIndex
+
+SIZES = [1000, 10000, 100000, 1000000]
+CATEGORIES = 6
+DRAWS = 20000
+BASELINE_DRAWS = 20
+
+
+def build_index(size):
+    index = DrawIndex()
+    index.load((i, i % CATEGORIES + 1) for i in range(1, size + 1))
+    return index
+
+
+def time_per_call(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    print('%10s %16s %16s' % ('questions', 'index draw (us)', 'full scan (us)'))
+    for size in SIZES:
+        index = build_index(size)
+        ids = list(range(1, size + 1))
+        previous = random.sample(ids, 5)
+
+        def index_draw():
+            index.draw(random.randint(1, CATEGORIES), previous)
+
+        def full_scan():
+            category = random.randint(1, CATEGORIES)
+            seen = set(previous)
+            candidates = [i for i in ids
+                          if i % CATEGORIES + 1 == category and i not in seen]
+            random.choice(candidates)
+
+        print('%10d %16.2f %16.2f' % (
+            size,
+            time_per_call(index_draw, DRAWS) * 1e6,
+            time_per_call(full_scan, BASELINE_DRAWS) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Search benchmark.
+
+Builds the in-process inverted index over a generated corpus (1M questions
+by default) and compares ranked, paginated queries against a linear
+case-insensitive substring scan, which is what ILIKE '%term%' does. Then
+times search-as-you-type completions, cold and from the prefix cache.
+
+    python -m benchmarks.bench_search [size]
+"""
+import itertools
+import random
+import sys
+import time
+
+from flaskr.search import InvertedIndex
+
+VOCABULARY = ['term%d' % i for i in range(20000)]
+QUERIES = ['term1', 'term42 term7', 'term999', 'term15000 term3', 'term19999']
+SCAN_QUERIES = 3
+PREFIXES = ['t', 'term', 'term1', 'term19', 'term1999']
+SUGGEST_REPEAT = 1000
+
+
+def generate_corpus(size, seed=0):
+    rng = random.Random(seed)
+    # Zipf-like word frequencies, so some terms are common and most are rare.
+    weights = list(itertools.accumulate(
+        1.0 / (rank + 1) for rank in range(len(VOCABULARY))))
+    for question_id in range(1, size + 1):
+        words = rng.choices(VOCABULARY, cum_weights=weights, k=12)
+        yield (question_id, 'Which %s?' % ' '.join(words[:9]),
+               ' '.join(words[9:]))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    corpus = list(generate_corpus(size))
+
+    start = time.perf_counter()
+    index = InvertedIndex()
+    index.load(corpus)
+    print('indexed %d questions in %.1fs' % (size, time.perf_counter() - start))
+
+    print('%-18s %8s %14s %14s' % ('query', 'hits', 'index (ms)', 'scan (ms)'))
+    for number, query in enumerate(QUERIES):
+        start = time.perf_counter()
+        page, total = index.search(query, 10)
+        indexed = time.perf_counter() - start
+
+        scanned = float('nan')
+        if number < SCAN_QUERIES:
+            needle = query.lower()
+            start = time.perf_counter()
+            [row for row in corpus if needle in row[1].lower()]
+            scanned = time.perf_counter() - start
+
+        print('%-18s %8d %14.3f %14.1f' % (
+            query, total, indexed * 1e3, scanned * 1e3))
+
+    print('%-18s %14s %14s' % ('prefix', 'cold (ms)', 'warm (us)'))
+    for prefix in PREFIXES:
+        start = time.perf_counter()
+        index.suggest(prefix, 10)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(SUGGEST_REPEAT):
+            index.suggest(prefix, 10)
+        warm = (time.perf_counter() - start) / SUGGEST_REPEAT
+        print('%-18s %14.3f %14.1f' % (prefix, cold * 1e3, warm * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Synthetic dataset generator for the benchmarks.
+
+Fills a database with categories and questions built from a fixed
+vocabulary, so search terms and category ids used by the benchmarks are
+known in advance. Works on SQLite and Postgres.
+
+    python -m benchmarks.dataset sqlite:///bench.db --size 100k
+    python -m benchmarks.dataset postgresql://postgres@localhost/bench --size 1m
+"""
+import argparse
+import itertools
+import random
+from collections import Counter
+
+from flask import Flask
+
+import migrations
+from flaskr import bulk
+from models import setup_db, db, adjust_stats, stat_key, Question, Category
+
+WORDS = ['word%d' % i for i in range(5000)]
+BATCH_SIZE = 10000
+
+
+def parse_size(value):
+    value = value.lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1], 1)
+    return int(value.rstrip('km')) * multiplier
+
+
+def generate_rows(count, categories, seed=0):
+    rng = random.Random(seed)
+    # Zipf-like word frequencies: a few common search terms, many rare ones.
+    weights = list(itertools.accumulate(
+        1.0 / (rank + 1) for rank in range(len(WORDS))))
+    for _ in range(count):
+        words = rng.choices(WORDS, cum_weights=weights, k=12)
+        yield {
+            'question': 'Which %s?' % ' '.join(words[:9]),
+            'answer': ' '.join(words[9:]),
+            'category': rng.randint(1, categories),
+            'difficulty': rng.randint(1, 5),
+        }
+
+
+def generate(database_url, size, categories=50, seed=0):
+    """Migrates the schema if needed and appends size questions."""
+    app = Flask(__name__)
+    setup_db(app, database_url)
+    with app.app_context():
+        migrations.upgrade(db.engine)
+        existing = set(
+            category_id for category_id, in db.session.query(Category.id))
+        missing = [{'id': category_id, 'type': 'Category %d' % category_id}
+                   for category_id in range(1, categories + 1)
+                   if category_id not in existing]
+        if missing:
+            db.session.execute(Category.__table__.insert(), missing)
+            db.session.commit()
+
+        rows = generate_rows(size, categories, seed)
+        postgres = db.engine.dialect.name == 'postgresql'
+        while True:
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            if postgres:
+                bulk.write_batch(batch)
+            else:
+                db.session.execute(Question.__table__.insert(), batch)
+                adjust_stats(Counter(
+                    stat_key(row['category'], row['difficulty'])
+                    for row in batch))
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('database_url')
+    parser.add_argument('--size', type=parse_size, default=parse_size('10k'),
+                        help='number of questions, e.g. 10k, 100k, 1m')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.database_url, args.size, args.categories, args.seed)
+
+
+if __name__ == '__main__':
+    main()
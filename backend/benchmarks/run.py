@@ -0,0 +1,302 @@
+"""
+Endpoint benchmark suite.
+
+Drives every route of create_app against a database filled by
+benchmarks.dataset, first through the Flask test client (one request at a
+time, no network) and then through a real threaded WSGI server with
+concurrent HTTP clients. Reports p50/p95/p99 latency, throughput, errors
+(5xx responses and bodies with "success": false) and peak RSS per scenario
+and writes them as JSON; --compare prints the change against an earlier
+run. RSS is sampled from /proc, so it is only reported on Linux.
+
+    python -m benchmarks.dataset sqlite:///bench.db --size 100k
+    python -m benchmarks.run sqlite:///bench.db --output after.json \\
+        --compare before.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import platform
+import random
+import resource
+import threading
+import time
+
+from sqlalchemy.engine.url import make_url
+from werkzeug.serving import make_server
+
+from benchmarks.dataset import WORDS
+from flaskr import create_app
+from flaskr.pagination import encode_cursor
+from models import setup_db, db, Question, Category
+
+PAGE_KB = resource.getpagesize() // 1024
+RSS_SAMPLE_SECONDS = 0.01
+
+
+class Workload(object):
+    """Builds randomized requests for each scenario from the dataset."""
+
+    def __init__(self, app, seed=0):
+        self.rng = random.Random(seed)
+        with app.app_context():
+            self.categories = [category_id for category_id, in
+                               db.session.query(Category.id)]
+            self.max_id = db.session.query(db.func.max(Question.id)).scalar()
+        self.created = []
+        self.lock = threading.Lock()
+
+    def scenarios(self):
+        rng = self.rng
+        return [
+            ('categories', lambda: ('GET', '/categories', None)),
+            ('questions_page', lambda: (
+                'GET', '/questions?page=%d' % rng.randint(1, 100), None)),
+            ('questions_cursor', lambda: (
+                'GET', '/questions?after=%s' % encode_cursor(
+                    rng.randint(1, self.max_id)), None)),
+            ('category_questions', lambda: (
+                'GET', '/categories/%d/questions' % rng.choice(
+                    self.categories), None)),
+            ('search', lambda: (
+                'POST', '/questions/search',
+                {'searchTerm': rng.choice(WORDS[:500])})),
+            ('quiz_draw', lambda: (
+                'POST', '/quizzes', {
+                    'previous_questions': [],
+                    'quiz_category': {'id': rng.choice(self.categories)}})),
+            ('create', lambda: (
+                'POST', '/questions', {
+                    'question': 'Benchmark %s?' % rng.choice(WORDS),
+                    'answer': 'Benchmark',
+                    'category': rng.choice(self.categories),
+                    'difficulty': 1})),
+            ('delete', self.delete_request),
+        ]
+
+    def delete_request(self):
+        with self.lock:
+            question_id = self.created.pop() if self.created else \
+                self.rng.randint(1, self.max_id)
+        return 'DELETE', '/questions/%d' % question_id, None
+
+    def remember(self, app):
+        # Deletes target the questions the create scenario just added.
+        with app.app_context():
+            self.created = [question_id for question_id, in db.session.query(
+                Question.id).filter(Question.answer == 'Benchmark')]
+
+
+def current_rss_kb():
+    """Resident set size of this process right now, or None off Linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_KB
+    except (IOError, OSError):
+        return None
+
+
+def measure_rss(run):
+    """
+    Calls run() while a thread samples the RSS; returns its result with
+    the peak and the growth over the call added, in KB.
+    """
+    before = current_rss_kb()
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], current_rss_kb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    if before is not None:
+        sampler.start()
+    try:
+        result = run()
+    finally:
+        done.set()
+    if before is None:
+        return result
+    sampler.join()
+    after = current_rss_kb()
+    result['peak_rss_kb'] = max(peak[0], after)
+    result['rss_growth_kb'] = after - before
+    return result
+
+
+def failed(status, body):
+    """A 5xx, or a body that reports "success": false."""
+    if status >= 500:
+        return True
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get('success') is False
+
+
+def summarize(scenario, mode, latencies, errors, wall_time, concurrency):
+    latencies.sort()
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        position = min(int(len(latencies) * fraction), len(latencies) - 1)
+        return round(latencies[position] * 1e3, 3)
+
+    return {
+        'scenario': scenario,
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'throughput_rps': round(len(latencies) / wall_time, 1),
+    }
+
+
+def run_test_client(app, scenario, make_request, count):
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        method, path, body = make_request()
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - start)
+        errors += failed(response.status_code, response.get_data())
+    return summarize(scenario, 'test_client', latencies, errors,
+                     time.perf_counter() - started, 1)
+
+
+def run_server(port, scenario, make_request, count, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [count]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                method, path, body = make_request()
+            payload = json.dumps(body) if body is not None else None
+            start = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+                conn.request(method, path, payload,
+                             {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                data = response.read()
+                status = response.status
+                conn.close()
+            except OSError:
+                status, data = 599, b''
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed(status, data)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(scenario, 'server', latencies, errors[0],
+                     time.perf_counter() - started, concurrency)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(row['scenario'], row['mode']): row
+                    for row in json.load(f)['results']}
+    print('\n%-20s %-12s %12s %12s' % ('scenario', 'mode', 'p95 change',
+                                       'rps change'))
+    for row in results:
+        before = baseline.get((row['scenario'], row['mode']))
+        if not before or not before['p95_ms'] or not before['throughput_rps']:
+            continue
+        print('%-20s %-12s %+11.1f%% %+11.1f%%' % (
+            row['scenario'], row['mode'],
+            (row['p95_ms'] / before['p95_ms'] - 1) * 100,
+            (row['throughput_rps'] / before['throughput_rps'] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('database_url')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per scenario and mode')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mode', choices=['test_client', 'server', 'both'],
+                        default='both')
+    parser.add_argument('--scenario', action='append',
+                        help='only run these scenarios')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the response cache enabled')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare')
+    args = parser.parse_args()
+
+    app = create_app(active=False, test_config={
+        'RESPONSE_CACHE': 'memory' if args.cache else 'none'})
+    setup_db(app, args.database_url)
+    # Per-request access logs and slow-query warnings would dominate the
+    # timings of the server mode.
+    app.logger.setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    workload = Workload(app)
+    scenarios = [(name, make_request)
+                 for name, make_request in workload.scenarios()
+                 if not args.scenario or name in args.scenario]
+
+    results = []
+    if args.mode in ('test_client', 'both'):
+        for name, make_request in scenarios:
+            if name == 'delete':
+                workload.remember(app)
+            results.append(measure_rss(lambda: run_test_client(
+                app, name, make_request, args.requests)))
+            print(json.dumps(results[-1]))
+
+    if args.mode in ('server', 'both'):
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            for name, make_request in scenarios:
+                if name == 'delete':
+                    workload.remember(app)
+                results.append(measure_rss(lambda: run_server(
+                    server.server_port, name, make_request, args.requests,
+                    args.concurrency)))
+                print(json.dumps(results[-1]))
+        finally:
+            server.shutdown()
+
+    report = {
+        'database': repr(make_url(args.database_url)),
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('peak RSS %d KB, results written to %s' % (
+        report['peak_rss_kb'], args.output))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
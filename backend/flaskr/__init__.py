@@ -2,43 +2,82 @@ import os
 from flask import Flask, request, abort, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
+import migrations
 from models import setup_db, Question, Category
+from flaskr import batch, bulk, cache, catalog, coalesce, dedupe, draw, \
+    fields, leaderboard, metrics, pagination, quiz_sessions, search, stats, \
+    versioning, write_behind
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_BATCH_SIZE = 5
+MAX_QUIZ_BATCH_SIZE = 50
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
 
 
 def create_app(active=True, test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config:
+        app.config.from_mapping(test_config)
     with app.app_context():
         if active:
             setup_db(app)
 
+    migrations.init_app(app)
+    metrics.init_app(app)
+    draw.init_app(app)
+    quiz_sessions.init_app(app)
+    search.init_app(app)
+    response_cache = cache.init_app(app)
+    single_flight = coalesce.init_app(app)
+    bulk.init_app(app)
+    stats.init_app(app)
+    write_behind.init_app(app)
+    conditional = versioning.init_app(app)
+    catalog.init_app(app)
+    dedupe.init_app(app)
+    leaderboard.init_app(app)
+
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
     @app.after_request
     def after_request(response):
         response.headers.add(
             'Access-Control-Allow-Headers',
-            'Content-Type, Authorization')
+            'Content-Type, Authorization, X-Write-Token')
         response.headers.add(
             'Access-Control-Allow-Methods',
             'GET, POST, PATCH, DELETE, OPTIONS')
         return response
 
+    def default_count_mode():
+        # Cursor paging exists to avoid full scans, so it skips COUNT(*)
+        # unless ?count= asks for it.
+        return 'none' if request.args.get('after') else 'exact'
+
     @app.route('/categories', methods=['GET'])
+    @conditional
+    @response_cache.cached('categories', 'questions')
+    @single_flight.coalesced()
     def get_categories():
         try:
-            categories = Category.query.all()
-
-            categories_list = {
-                category.id: category.type for category in categories}
+            snapshot = catalog.get_snapshot()
+            if snapshot is not None:
+                categories_list = snapshot.categories()
+            else:
+                categories_list = {
+                    category.id: category.type
+                    for category in Category.query.all()}
+            statistics = stats.counts()
 
             return jsonify({
                 'success': True,
-                'categories': categories_list
+                'categories': categories_list,
+                'statistics': statistics,
+                'total_questions': sum(
+                    entry['questions'] for entry in statistics.values())
             })
 
         except Exception as e:
@@ -49,26 +88,59 @@ def create_app(active=True, test_config=None):
             })
 
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @conditional
+    @response_cache.cached('categories', 'questions:{category_id}')
+    @single_flight.coalesced()
     def get_category_questions(category_id):
         try:
-            category = session.get(category_id)
+            snapshot = catalog.get_snapshot()
+            if snapshot is not None:
+                category_type = snapshot.category_type(category_id)
+            else:
+                category = Category.query.get(category_id)
+                category_type = category.type if category else None
 
-            if not category:
+            if category_type is None:
                 return jsonify({
                     'success': False,
                     'error': 'Category not found',
                 }), 404
 
-            questions = Question.query.filter(
-                Question.category == category_id).all()
-
-            total_questions = [question.format() for question in questions]
+            try:
+                selected = fields.requested()
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                }), 422
+
+            query = fields.select(selected).filter(
+                Question.category == category_id)
+
+            try:
+                if snapshot is not None:
+                    questions_list, next_cursor = catalog.paginate(
+                        snapshot, QUESTIONS_PER_PAGE, category_id, selected)
+                    total_questions = catalog.count(
+                        snapshot, category_id, default_count_mode())
+                else:
+                    questions, next_cursor = pagination.paginate(
+                        query, QUESTIONS_PER_PAGE, scope=(category_id,))
+                    questions_list = fields.serialize(questions, selected)
+                    total_questions = stats.count(
+                        category_id, default_count_mode())
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor',
+                }), 422
 
             return jsonify({
                 'success': True,
-                'questions': total_questions,
-                'totalQuestions': len(total_questions),
-                'currentCategory': category.type
+                'questions': questions_list,
+                'totalQuestions': total_questions,
+                'currentCategory': category_type,
+                'next_cursor': next_cursor
             })
 
         except Exception as e:
@@ -79,35 +151,42 @@ def create_app(active=True, test_config=None):
             })
 
     @app.route('/questions', methods=['GET'])
+    @conditional
+    @response_cache.cached('categories', 'questions')
+    @single_flight.coalesced()
     def get_questions():
-        questions_per_page = 10
-
-        page = request.args.get('page', 1, type=int)
-
-        start_index = (page - 1) * questions_per_page
-
-        questions = Question.query.limit(
-            questions_per_page).offset(start_index).all()
-
-        questions_list = [{'id': question.id,
-                           'question': question.question,
-                           'answer': question.answer,
-                           'category': question.category,
-                           'difficulty': question.difficulty} for question in questions]
+        snapshot = catalog.get_snapshot()
+        try:
+            selected = fields.requested()
+            if snapshot is not None:
+                questions_list, next_cursor = catalog.paginate(
+                    snapshot, QUESTIONS_PER_PAGE, fields=selected)
+            else:
+                questions, next_cursor = pagination.paginate(
+                    fields.select(selected), QUESTIONS_PER_PAGE)
+                questions_list = fields.serialize(questions, selected)
+        except ValueError:
+            abort(422)
 
-        total_questions = Question.query.count()
-        if len(questions) == 0:
+        if len(questions_list) == 0:
             abort(404)
-        categories = Category.query.all()
-        categories_list = {
-            category.id: category.type for category in categories}
+        if snapshot is not None:
+            total_questions = catalog.count(
+                snapshot, default=default_count_mode())
+            categories_list = snapshot.categories()
+        else:
+            total_questions = stats.count(default=default_count_mode())
+            categories_list = {
+                category.id: category.type
+                for category in Category.query.all()}
 
         return jsonify({
             'success': True,
             'questions': questions_list,
             'total_questions': total_questions,
             'current_category': 'Science',
-            'categories': categories_list
+            'categories': categories_list,
+            'next_cursor': next_cursor
         })
 
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
@@ -119,13 +198,10 @@ def create_app(active=True, test_config=None):
                 abort(422)
             else:
                 question.delete()
-                total_questions = Question.query.count()
 
             return jsonify({
                 'success': True,
-                'deleted': question_id,
-                'questions': Question.query.all(),
-                'totalQuestions': total_questions
+                'deleted': question_id
             })
 
         except Exception as e:
@@ -135,10 +211,85 @@ def create_app(active=True, test_config=None):
                 'error': 'An error occurred while deleting the question'
             })
 
+    @app.route('/questions/batch-delete', methods=['POST'])
+    def delete_questions():
+        try:
+            data = request.get_json() or {}
+            try:
+                scopes = batch.criteria(data)
+            except (TypeError, ValueError) as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 422
+
+            deleted = batch.delete_many(scopes)
+
+            return jsonify({
+                'success': True,
+                'deleted': deleted,
+                'count': len(deleted)
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while deleting the questions'
+            })
+
+    @app.route('/questions/batch-update', methods=['POST'])
+    def update_questions():
+        try:
+            data = request.get_json() or {}
+            try:
+                scopes = batch.criteria(data)
+                values = batch.changes(data.get('set') or {})
+            except (TypeError, ValueError) as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 422
+
+            updated = batch.update_many(scopes, values)
+
+            return jsonify({
+                'success': True,
+                'updated': updated,
+                'count': len(updated)
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while updating the questions'
+            })
+
     @app.route('/questions', methods=['POST'])
     def create_question():
+        if write_behind.enabled():
+            try:
+                token, error = write_behind.submit(request.get_json() or {})
+            except write_behind.QueueFull:
+                abort(503)
+            if error is not None:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 422
+            response = jsonify({
+                'success': True,
+                'queued': True,
+                'write_token': token
+            })
+            response.headers[write_behind.TOKEN_HEADER] = token
+            return response, 202
+
         try:
             data = request.get_json()
+            duplicates = dedupe.find_duplicates(
+                data.get('question') or '', data.get('answer') or '')
 
             new_question = Question(
                 question=data.get('question', ''),
@@ -150,7 +301,8 @@ def create_app(active=True, test_config=None):
             new_question.insert()
 
             return jsonify({
-                'success': True
+                'success': True,
+                'duplicates': duplicates
             })
 
         except Exception as e:
@@ -160,16 +312,53 @@ def create_app(active=True, test_config=None):
                 'error': 'An error occurred while creating the question'
             })
 
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions():
+        fmt = request.args.get('format') or (
+            'csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            abort(422)
+        try:
+            lines = (line.decode('utf-8') for line in request.stream)
+
+            summary = bulk.import_questions(lines, fmt)
+
+            summary['success'] = True
+            return jsonify(summary)
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while importing questions'
+            })
+
+    @app.route('/questions/export', methods=['GET'])
+    @conditional
+    def export_questions():
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            abort(422)
+        return bulk.export_response(fmt)
+
     @app.route('/questions/search', methods=['POST'])
     def search_questions():
         try:
-            search_term = request.get_json().get('searchTerm', '')
+            data = request.get_json()
+            search_term = data.get('searchTerm', '')
+            page = max(int(data.get('page', request.args.get('page', 1))), 1)
+            try:
+                selected = fields.requested()
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                }), 422
 
-            questions = Question.query.filter(
-                Question.question.ilike(
-                    f'%{search_term}%')).all()
+            questions, total_questions = search.search_questions(
+                search_term, page, QUESTIONS_PER_PAGE, selected)
 
-            questions_list = [question.format() for question in questions]
+            questions_list = fields.serialize(questions, selected)
 
             if len(questions_list) == 0:
                 abort(422)
@@ -177,7 +366,8 @@ def create_app(active=True, test_config=None):
             return jsonify({
                 'success': True,
                 'questions': questions_list,
-                'totalQuestions': len(questions)
+                'totalQuestions': total_questions,
+                'page': page
             })
 
         except Exception as e:
@@ -187,24 +377,66 @@ def create_app(active=True, test_config=None):
                 'error': 'An error occurred while searching for questions'
             })
 
+    @app.route('/questions/suggest', methods=['GET'])
+    def suggest_questions():
+        try:
+            limit = max(1, request.args.get('limit', 10, type=int))
+
+            return jsonify({
+                'success': True,
+                'suggestions': search.suggest(
+                    request.args.get('q', ''), limit)
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while suggesting search terms'
+            })
+
     @app.route('/questions/category/<int:category_id>', methods=['GET'])
+    @conditional
+    @response_cache.cached('questions:{category_id}')
+    @single_flight.coalesced()
     def get_questions_by_category(category_id):
         try:
+            try:
+                selected = fields.requested()
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                }), 422
+
+            snapshot = catalog.get_snapshot()
+            try:
+                if snapshot is not None:
+                    formatted_questions, next_cursor = catalog.paginate(
+                        snapshot, QUESTIONS_PER_PAGE, category_id, selected)
+                else:
+                    questions, next_cursor = pagination.paginate(
+                        fields.select(selected).filter(
+                            Question.category == category_id),
+                        QUESTIONS_PER_PAGE, scope=(category_id,))
+                    formatted_questions = fields.serialize(
+                        questions, selected)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor',
+                }), 422
 
-            questions = Question.query.filter(
-                Question.category == category_id).all()
-
-            if not questions:
+            if not formatted_questions:
                 return jsonify({
                     'success': False,
                     'error': 'No questions found for the specified category'
                 }), 404
 
-            formatted_questions = [question.format() for question in questions]
-
             return jsonify({
                 'success': True,
-                'questions': formatted_questions
+                'questions': formatted_questions,
+                'next_cursor': next_cursor
             })
 
         except Exception as e:
@@ -220,31 +452,137 @@ def create_app(active=True, test_config=None):
         try:
             data = request.get_json()
             category = data.get('quiz_category')
-            cate_id = category.get('id') if category else None
+            cate_id = (category.get('id') if category else None) or \
+                draw.DrawIndex.ALL
             previous_questions = data.get('previous_questions', [])
-            question = None
 
-            if cate_id == 0:
-                questions = Question.query.filter(
-                    Question.id.notin_(previous_questions)
-                ).all()
+            snapshot = catalog.get_snapshot()
+            if snapshot is not None:
+                formatted_question = snapshot.draw(
+                    cate_id, previous_questions)
             else:
-                questions = Question.query.filter(
-                    Question.id.notin_(previous_questions),
-                    Question.category == cate_id
-                ).all()
+                question = draw.draw_question(cate_id, previous_questions)
+                formatted_question = question.format() if question else None
+
+            if formatted_question is None:
+                abort(422)
+
+            return jsonify({
+                'success': True,
+                'question': formatted_question
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while getting a quiz question'
+            })
+
+    def quiz_batch_size(data, default=1):
+        count = data.get('count', request.args.get('count', default))
+        return max(1, min(int(count), MAX_QUIZ_BATCH_SIZE))
+
+    @app.route('/quizzes/batch', methods=['POST'])
+    def get_quiz_questions():
+        try:
+            data = request.get_json() or {}
+            category = data.get('quiz_category')
+            cate_id = category.get('id') if category else None
+            difficulty = data.get('difficulty')
+            try:
+                count = quiz_batch_size(data, QUIZ_BATCH_SIZE)
+                if isinstance(difficulty, dict):
+                    difficulty = dict(
+                        (int(level), float(weight))
+                        for level, weight in difficulty.items())
+                elif difficulty not in (None, 'stratified'):
+                    raise ValueError(difficulty)
+            except (TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': 'count must be an integer and difficulty '
+                             '"stratified" or an object of weights',
+                }), 422
+
+            questions = draw.draw_questions(
+                cate_id or draw.DrawIndex.ALL, count,
+                data.get('previous_questions', []), difficulty)
+
+            return jsonify({
+                'success': True,
+                'questions': [question.format() for question in questions]
+            })
 
-            if len(questions) == 0:
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while getting quiz questions'
+            })
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        try:
+            data = request.get_json() or {}
+            category = data.get('quiz_category')
+            cate_id = category.get('id') if category else None
+
+            token, total = quiz_sessions.start_session(cate_id)
+
+            if token is None:
                 abort(422)
 
-            if questions:
-                question = random.choice(questions)
+            return jsonify({
+                'success': True,
+                'session': token,
+                'totalQuestions': total
+            })
 
-            formatted_question = question.format()
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while starting a quiz session'
+            })
+
+    @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+    def next_quiz_question(token):
+        try:
+            try:
+                count = quiz_batch_size(request.get_json(silent=True) or {})
+            except (TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': 'count must be an integer',
+                }), 422
+
+            questions = []
+            while len(questions) < count:
+                question_ids = quiz_sessions.next_question_ids(
+                    token, count - len(questions))
+
+                if question_ids is None:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Quiz session not found',
+                    }), 404
+
+                if not question_ids:
+                    break
+
+                # Skips cards whose question was deleted mid-game.
+                found = dict((question.id, question) for question in
+                             Question.query.filter(
+                                 Question.id.in_(question_ids)))
+                questions.extend(found[question_id]
+                                 for question_id in question_ids
+                                 if question_id in found)
 
             return jsonify({
                 'success': True,
-                'question': formatted_question
+                'question': questions[0].format() if questions else None,
+                'questions': [question.format() for question in questions]
             })
 
         except Exception as e:
@@ -254,6 +592,109 @@ def create_app(active=True, test_config=None):
                 'error': 'An error occurred while getting a quiz question'
             })
 
+    @app.route('/quizzes/results', methods=['POST'])
+    def record_quiz_result():
+        try:
+            result, error = leaderboard.validate(
+                request.get_json(silent=True) or {})
+            if error is None and result[1] != leaderboard.ALL and \
+                    Category.query.get(result[1]) is None:
+                error = 'Unknown category %d' % result[1]
+            if error is not None:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 422
+
+            rank, score, duration = \
+                leaderboard.get_leaderboards().record(*result)
+
+            return jsonify({
+                'success': True,
+                'rank': rank,
+                'best': {'score': score, 'duration': duration}
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while recording the result'
+            })
+
+    @app.route('/leaderboard/<int:category_id>', methods=['GET'])
+    def get_leaderboard(category_id):
+        try:
+            try:
+                limit = max(1, min(int(request.args.get(
+                    'limit', LEADERBOARD_SIZE)), MAX_LEADERBOARD_SIZE))
+                offset = max(0, int(request.args.get('offset', 0)))
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'limit and offset must be integers',
+                }), 422
+
+            leaders, players = leaderboard.get_leaderboards().top(
+                category_id, limit, offset)
+
+            return jsonify({
+                'success': True,
+                'category': category_id,
+                'leaders': [{
+                    'rank': rank,
+                    'player': player,
+                    'score': score,
+                    'duration': duration
+                } for rank, player, score, duration in leaders],
+                'players': players
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while fetching the leaderboard'
+            })
+
+    @app.route('/leaderboard/<int:category_id>/players/<player>',
+               methods=['GET'])
+    def get_player_rank(category_id, player):
+        try:
+            best = leaderboard.get_leaderboards().rank(category_id, player)
+            if best is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Player not ranked',
+                }), 404
+            rank, score, duration = best
+
+            return jsonify({
+                'success': True,
+                'category': category_id,
+                'player': player,
+                'rank': rank,
+                'score': score,
+                'duration': duration
+            })
+
+        except Exception as e:
+            print(e)
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while fetching the rank'
+            })
+
+    @app.route('/cache/stats', methods=['GET'])
+    def get_cache_stats():
+        stats = response_cache.stats()
+        stats['success'] = True
+        return jsonify(stats)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return metrics.render()
+
     @app.errorhandler(404)
     def not_found_error(error):
         return jsonify({
@@ -275,6 +716,12 @@ def create_app(active=True, test_config=None):
         return (jsonify({"success": False, "error": 405,
                          "message": "method not allowed"}), 405, )
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return (jsonify({"success": False, "error": 503,
+                         "message": "Too many pending writes, retry later"}),
+                503, {'Retry-After': '1'})
+
     @app.errorhandler(500)
     def server_error(error):
         return (jsonify({"success": False, "error": 500,
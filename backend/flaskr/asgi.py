@@ -0,0 +1,312 @@
+"""
+Optional ASGI serving mode.
+
+Search and the quiz draw, the hot uncacheable reads, are served natively
+on an asyncpg connection pool, so a single process can keep thousands of
+requests waiting on Postgres without tying up a thread for each. Every
+other route, including the GET listings with their conditional, cached
+and coalesced responses, is handed to the regular Flask app on a thread
+pool, so the routes and JSON contracts stay the same. The native routes
+are recorded in the same /metrics.
+
+Requires Postgres plus the optional asyncpg and uvicorn packages:
+
+    pip install asyncpg uvicorn
+    uvicorn --factory flaskr.asgi:create_asgi_app --port 5000
+"""
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from flaskr import create_app, draw, fields, QUESTIONS_PER_PAGE
+from flaskr.draw import as_key
+from flaskr.metrics import DEFAULT_SLOW_QUERY_SECONDS
+from flaskr.search import PG_CONFIG, PG_DOCUMENT
+from models import db, setup_db, database_path
+
+logger = logging.getLogger(__name__)
+
+SELECT_QUESTIONS = 'SELECT %s FROM questions' % ', '.join(
+    fields.QUESTION_FIELDS)
+CORS_HEADERS = [
+    (b'access-control-allow-headers',
+     b'Content-Type, Authorization, X-Write-Token'),
+    (b'access-control-allow-methods', b'GET, POST, PATCH, DELETE, OPTIONS'),
+]
+
+
+class Request(object):
+
+    def __init__(self, scope, body):
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.body = body
+        self.sql = {'count': 0, 'seconds': 0.0, 'slow': 0, 'n_plus_one': 0}
+
+    def get_json(self):
+        return json.loads(self.body) if self.body else None
+
+
+def _format(row, selected=fields.QUESTION_FIELDS):
+    return {field: row[field] for field in selected}
+
+
+class AsyncTrivia(object):
+
+    def __init__(self, database_url, wsgi_app, pool_size=20, threads=16):
+        if asyncpg is None:
+            raise RuntimeError('The ASGI mode needs the asyncpg package')
+        self.database_url = database_url
+        self.wsgi_app = wsgi_app
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(threads)
+        self.pool = None
+        self.resync_task = None
+        # Shared with the Flask app, so writes handled there keep it current.
+        self.draw_index = wsgi_app.extensions['trivia.draw']
+        self.metrics = wsgi_app.extensions['trivia.metrics']
+        self.slow_query_seconds = wsgi_app.config.get(
+            'SLOW_QUERY_SECONDS', DEFAULT_SLOW_QUERY_SECONDS)
+        self.routes = [
+            ('POST', '/questions/search', self.search_questions),
+            ('POST', '/quizzes', self.get_quiz_question),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        body = await self.read_body(receive)
+        for method, rule, handler in self.routes:
+            if scope['path'] == rule and scope['method'] == method:
+                start = time.perf_counter()
+                request = Request(scope, body)
+                status, payload = await self.dispatch(handler, request)
+                await self.send_json(send, status, payload)
+                self.metrics.observe_request(
+                    rule, method, time.perf_counter() - start, request.sql)
+                return
+        await self.call_wsgi(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.pool = await asyncpg.create_pool(
+                    self.database_url, min_size=1, max_size=self.pool_size)
+                await asyncio.get_event_loop().run_in_executor(
+                    self.executor, self.sync_draw_index)
+                self.resync_task = asyncio.ensure_future(self.resync())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.resync_task.cancel()
+                await self.pool.close()
+                self.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def sync_draw_index(self):
+        """Loads the draw index, or reloads it after other workers' writes."""
+        with self.wsgi_app.app_context():
+            try:
+                draw.get_index()
+            finally:
+                db.session.remove()
+
+    async def resync(self):
+        # The native draw never goes through draw.get_index(), so check for
+        # other workers' writes on the same schedule here.
+        interval = self.wsgi_app.extensions['trivia.draw.resync'].interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.get_event_loop().run_in_executor(
+                    self.executor, self.sync_draw_index)
+            except Exception:
+                logger.exception('Reloading the draw index failed')
+
+    async def dispatch(self, handler, request):
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception('Error in %s', handler.__name__)
+            return 200, {
+                'success': False,
+                'error': 'An error occurred while handling the request'
+            }
+
+    async def query(self, request, method, statement, *args):
+        """Runs pool.<method>, counting it into the request's SQL stats."""
+        start = time.perf_counter()
+        try:
+            return await getattr(self.pool, method)(statement, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            request.sql['count'] += 1
+            request.sql['seconds'] += elapsed
+            if elapsed >= self.slow_query_seconds:
+                request.sql['slow'] += 1
+                logger.warning('Slow query (%.1f ms) in %s: %s',
+                               elapsed * 1e3, request.path, statement)
+
+    async def search_questions(self, request):
+        data = request.get_json() or {}
+        page = max(int(data.get('page', request.args.get('page', 1))), 1)
+        try:
+            selected = fields.parse(request.args.get('fields'))
+        except ValueError as e:
+            return 422, {'success': False, 'error': str(e)}
+        # selected only holds QUESTION_FIELDS names, safe to interpolate.
+        rows = await self.query(
+            request, 'fetch',
+            'SELECT %s, count(*) OVER () AS total '
+            'FROM questions, plainto_tsquery(\'%s\', $1) query '
+            'WHERE %s @@ query ORDER BY ts_rank(%s, query) DESC, id '
+            'LIMIT $2 OFFSET $3' % (
+                ', '.join(selected), PG_CONFIG, PG_DOCUMENT, PG_DOCUMENT),
+            data.get('searchTerm', ''), QUESTIONS_PER_PAGE,
+            (page - 1) * QUESTIONS_PER_PAGE)
+        if not rows:
+            return 200, {
+                'success': False,
+                'error': 'An error occurred while searching for questions'
+            }
+        return 200, {
+            'success': True,
+            'questions': [_format(row, selected) for row in rows],
+            'totalQuestions': rows[0]['total'],
+            'page': page
+        }
+
+    async def get_quiz_question(self, request):
+        data = request.get_json() or {}
+        category = data.get('quiz_category')
+        cate_id = category.get('id') if category else None
+        previous_questions = data.get('previous_questions', [])
+        while True:
+            question_id = self.draw_index.draw(cate_id, previous_questions)
+            if question_id is None:
+                return 200, {
+                    'success': False,
+                    'error': 'An error occurred while getting a quiz question'
+                }
+            row = await self.query(
+                request, 'fetchrow', SELECT_QUESTIONS + ' WHERE id = $1',
+                as_key(question_id))
+            if row is not None:
+                return 200, {'success': True, 'question': _format(row)}
+            self.draw_index.remove(question_id)
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def send_json(self, send, status, payload):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())]
+            + CORS_HEADERS,
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def call_wsgi(self, scope, body, send):
+        loop = asyncio.get_event_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(
+            self.executor, run_wsgi, self.wsgi_app,
+            wsgi_environ(scope, body), send_from_thread)
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value \
+                if key in environ else value
+    return environ
+
+
+def run_wsgi(app, environ, send):
+    """
+    Runs a WSGI app in a worker thread and hands every body chunk to send()
+    as it is produced, so streamed responses such as /questions/export are
+    never held in memory as a whole.
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers]
+
+    def start():
+        if not response.get('started'):
+            response['started'] = True
+            send({'type': 'http.response.start',
+                  'status': response['status'],
+                  'headers': response['headers']})
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            if chunk:
+                start()
+                send({'type': 'http.response.body', 'body': chunk,
+                      'more_body': True})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    start()
+    send({'type': 'http.response.body', 'body': b''})
+
+
+def create_asgi_app(database_url=database_path, pool_size=20, threads=16):
+    app = create_app(active=False)
+    setup_db(app, database_url)
+    return AsyncTrivia(database_url, app, pool_size, threads)
@@ -0,0 +1,104 @@
+from collections import Counter
+
+from models import db, adjust_stats, notify, stat_key, Question, Category
+
+CHUNK_SIZE = 1000
+COLUMNS = (Question.id, Question.question, Question.answer,
+           Question.category, Question.difficulty)
+FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def criteria(data):
+    """
+    Builds the WHERE clauses of a batch from either
+        {"ids": [1, 2, 3]}
+    or
+        {"filter": {"category": 3, "difficulty": 2}}
+    as a list of clause lists, one per CHUNK_SIZE ids, so no statement
+    carries an unbounded IN (...). Raises ValueError for anything else,
+    so an empty body can never match the whole table.
+    """
+    if data.get('ids') is not None:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non-empty list')
+        ids = sorted({int(question_id) for question_id in ids})
+        return [[Question.id.in_(chunk)] for chunk in _chunks(ids)]
+    filters = data.get('filter') or {}
+    clauses = []
+    for field in ('category', 'difficulty'):
+        if field in filters:
+            clauses.append(getattr(Question, field) == int(filters[field]))
+    if not clauses or set(filters) - {'category', 'difficulty'}:
+        raise ValueError('filter needs category and/or difficulty')
+    return [clauses]
+
+
+def changes(data):
+    values = {}
+    for field in ('category', 'difficulty'):
+        if field in data:
+            values[field] = int(data[field])
+    if not values:
+        raise ValueError('set needs category and/or difficulty')
+    if 'difficulty' in values and not 1 <= values['difficulty'] <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    if 'category' in values and \
+            Category.query.get(values['category']) is None:
+        raise ValueError('Unknown category %s' % values['category'])
+    return values
+
+
+def _affected(scopes):
+    # Locks the rows on Postgres; SQLite serializes writers anyway. The id
+    # chunks are ascending, so the records stay in id order.
+    records = []
+    for clauses in scopes:
+        records.extend(
+            dict(zip(FIELDS, row)) for row in db.session.query(*COLUMNS)
+            .filter(*clauses).order_by(Question.id).with_for_update())
+    return records
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def delete_many(scopes):
+    """Deletes the matching questions in one transaction; returns their ids."""
+    records = _affected(scopes)
+    ids = [record['id'] for record in records]
+    for chunk in _chunks(ids):
+        Question.query.filter(Question.id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    deltas = Counter()
+    for record in records:
+        deltas[stat_key(record['category'], record['difficulty'])] -= 1
+    adjust_stats(deltas)
+    db.session.commit()
+    if records:
+        notify('delete', 'question', records)
+    return ids
+
+
+def update_many(scopes, values):
+    """Applies values to the matching questions in one transaction."""
+    records = _affected(scopes)
+    ids = [record['id'] for record in records]
+    for chunk in _chunks(ids):
+        Question.query.filter(Question.id.in_(chunk)) \
+            .update(values, synchronize_session=False)
+    deltas = Counter()
+    for record in records:
+        deltas[stat_key(record['category'], record['difficulty'])] -= 1
+        deltas[stat_key(values.get('category', record['category']),
+                        values.get('difficulty', record['difficulty']))] += 1
+    adjust_stats(deltas)
+    db.session.commit()
+    for record in records:
+        record['previous_category'] = record['category']
+        record.update(values)
+    if records:
+        notify('update', 'question', records)
+    return ids
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+
+import click
+from flask import Response, stream_with_context
+from sqlalchemy import text
+
+from collections import Counter
+
+from models import db, adjust_stats, notify, stat_key, Question, Category
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_rows(lines, fmt):
+    """Yields (line number, row dict or None, error or None)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, 'Invalid JSON: %s' % e
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, row, None
+
+
+def validate(row, category_ids):
+    """Returns (cleaned row, None) or (None, error message)."""
+    cleaned = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, '%s is required' % field
+        if '\x00' in value:
+            # Postgres text cannot hold NUL, so the row would fail later.
+            return None, '%s must not contain NUL characters' % field
+        cleaned[field] = value.strip()
+    try:
+        cleaned['category'] = int(row.get('category'))
+        cleaned['difficulty'] = int(row.get('difficulty', 1))
+    except (TypeError, ValueError):
+        return None, 'category and difficulty must be integers'
+    if cleaned['category'] not in category_ids:
+        return None, 'Unknown category %s' % cleaned['category']
+    if not 1 <= cleaned['difficulty'] <= 5:
+        return None, 'difficulty must be between 1 and 5'
+    return cleaned, None
+
+
+def write_batch(rows):
+    """
+    Inserts rows in the current transaction and returns them with their ids;
+    category_stats is adjusted in the same transaction.
+
+    On Postgres the ids are reserved from the sequence in one round trip
+    and the rows are streamed with COPY; elsewhere they are inserted one
+    statement at a time, still under a single commit.
+    """
+    adjust_stats(Counter(
+        stat_key(row['category'], row['difficulty']) for row in rows))
+    if db.engine.dialect.name == 'postgresql':
+        ids = [row[0] for row in db.session.execute(text(
+            "SELECT nextval(pg_get_serial_sequence('questions', 'id')) "
+            "FROM generate_series(1, :n)"), {'n': len(rows)})]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for question_id, row in zip(ids, rows):
+            row['id'] = question_id
+            writer.writerow([question_id] + [row[field] for field in FIELDS])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY questions (id, question, answer, category, difficulty) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+        return rows
+    table = Question.__table__
+    for row in rows:
+        result = db.session.execute(table.insert(), row)
+        row['id'] = result.inserted_primary_key[0]
+    return rows
+
+
+def import_questions(lines, fmt='ndjson', batch_size=BATCH_SIZE):
+    """
+    Loads questions from an iterable of NDJSON or CSV lines.
+
+    Rows are validated and committed in batches. A batch the database
+    rejects is retried row by row, so one bad row only costs itself; every
+    rejected row is reported with its line number.
+    """
+    category_ids = set(
+        category_id for category_id, in db.session.query(Category.id))
+    summary = {'inserted': 0, 'failed': 0, 'errors': []}
+
+    def fail(line_number, error):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': error})
+
+    def flush(batch):
+        try:
+            records = write_batch([row for _, row in batch])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            records = []
+            for line_number, row in batch:
+                try:
+                    records.extend(write_batch([row]))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    fail(line_number, str(e).splitlines()[0])
+        summary['inserted'] += len(records)
+        if records:
+            notify('insert', 'question', records)
+
+    batch = []
+    for line_number, row, error in read_rows(lines, fmt):
+        if error is None:
+            row, error = validate(row, category_ids)
+        if error is not None:
+            fail(line_number, error)
+            continue
+        batch.append((line_number, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return summary
+
+
+def export_questions(fmt='ndjson', batch_size=BATCH_SIZE):
+    """Yields the questions table as NDJSON or CSV, one keyset batch at a time."""
+    columns = [Question.id, Question.question, Question.answer,
+               Question.category, Question.difficulty]
+    names = ['id'] + list(FIELDS)
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(Question.id > last_id) \
+            .order_by(Question.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        if fmt == 'csv':
+            writer.writerows(rows)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            chunk = ''.join(
+                json.dumps(dict(zip(names, row))) + '\n' for row in rows)
+        yield chunk
+        # The rows are plain tuples, but the session still holds the
+        # transaction open; end it so long exports don't pin a snapshot.
+        db.session.commit()
+    if fmt == 'csv' and buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def export_response(fmt):
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_questions(fmt)),
+                    mimetype=mimetype)
+
+
+"""
+init_app(app)
+    registers the import-questions and export-questions CLI commands
+"""
+
+
+def init_app(app):
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']))
+    @click.option('--batch-size', default=BATCH_SIZE)
+    def import_questions_command(path, fmt, batch_size):
+        """Bulk load questions from an NDJSON or CSV file."""
+        fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+        with open(path, newline='', encoding='utf-8') as lines:
+            summary = import_questions(lines, fmt, batch_size)
+        for error in summary['errors']:
+            click.echo('line %(line)d: %(error)s' % error, err=True)
+        click.echo('%d inserted, %d failed' % (
+            summary['inserted'], summary['failed']))
+
+    @app.cli.command('export-questions')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']))
+    def export_questions_command(path, fmt):
+        """Write every question to an NDJSON or CSV file."""
+        fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            for chunk in export_questions(fmt):
+                out.write(chunk)
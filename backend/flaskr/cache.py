@@ -0,0 +1,250 @@
+import collections
+import functools
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request, Response
+
+from flaskr.metrics import add_collector
+from models import add_listener
+
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 1024
+
+
+class MemoryCacheBackend(object):
+    """Per-process LRU cache with a TTL on every entry."""
+
+    shared = False
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._generations = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(object):
+    """
+    LRU/TTL cache in a local SQLite file, shared by every worker on the
+    host. Tag generations live in the same file, so a write in one worker
+    invalidates the entries of all of them.
+    """
+
+    shared = True
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+                'mimetype TEXT NOT NULL, body BLOB NOT NULL, '
+                'expires REAL NOT NULL, accessed REAL NOT NULL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS cache_entries_accessed '
+                'ON cache_entries (accessed)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_generations ('
+                'tag TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT status, mimetype, body FROM cache_entries '
+                'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE cache_entries SET accessed = ? WHERE key = ?',
+                (now, key))
+            return row[0], row[1], bytes(row[2])
+
+    def set(self, key, value):
+        now = time.time()
+        status, mimetype, body = value
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, status, mimetype, body, now + self.ttl, now))
+            conn.execute(
+                'DELETE FROM cache_entries WHERE expires <= ? OR key IN ('
+                'SELECT key FROM cache_entries ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)', (now, self.max_entries))
+
+    def generations(self, tags):
+        conn = self._connect()
+        rows = dict(conn.execute(
+            'SELECT tag, generation FROM cache_generations '
+            'WHERE tag IN (%s)' % ','.join('?' * len(tags)), tags))
+        return [rows.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._connect() as conn:
+            for tag in tags:
+                conn.execute(
+                    'INSERT OR IGNORE INTO cache_generations VALUES (?, 0)',
+                    (tag,))
+                conn.execute(
+                    'UPDATE cache_generations SET generation = generation + 1 '
+                    'WHERE tag = ?', (tag,))
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT count(*) FROM cache_entries').fetchone()[0]
+
+
+class ResponseCache(object):
+    """
+    Read-through cache of serialized GET responses.
+
+    Every entry is keyed on the request path plus the current generation
+    of each tag it depends on, e.g. 'categories' or 'questions:3'. Writes
+    bump the generations of the tags they touch, which makes the old keys
+    unreachable; the backend's LRU/TTL eviction then drops them. A
+    per-process backend only sees this worker's writes, so its keys also
+    carry the data version, which every worker on the host bumps.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cached(self, *tags):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                resolved = [tag.format(**kwargs) for tag in tags]
+                key = '%s|%s' % (request.full_path, ','.join(
+                    '%s=%d' % pair for pair in zip(
+                        resolved, self.backend.generations(resolved))))
+                if not self.backend.shared:
+                    key += '|v=%s:%d' % current_app.extensions[
+                        'trivia.data_version'].stamp()
+
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count(hit=True)
+                    status, mimetype, body = entry
+                    return Response(body, status=status, mimetype=mimetype)
+
+                self._count(hit=False)
+                response = view(*args, **kwargs)
+                if isinstance(response, Response) and \
+                        response.status_code == 200 and \
+                        (response.get_json(silent=True) or {}).get('success'):
+                    self.backend.set(key, (response.status_code,
+                                           response.mimetype,
+                                           response.get_data()))
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        if self.backend is not None:
+            self.backend.bump(list(tags))
+
+    def on_change(self, action, model, records):
+        if model == 'category':
+            self.invalidate('categories')
+        elif model == 'question':
+            categories = set()
+            for record in records:
+                categories.add(record['category'])
+                categories.add(record.get('previous_category',
+                                          record['category']))
+            self.invalidate('questions', *[
+                'questions:%s' % category for category in categories])
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.backend) if self.backend is not None else 0,
+        }
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+"""
+init_app(app)
+    builds the app's ResponseCache from RESPONSE_CACHE: 'memory' (default),
+    'sqlite:///path/to/cache.db' for a cache shared between workers, or
+    'none'. RESPONSE_CACHE_TTL and RESPONSE_CACHE_SIZE bound the entries.
+"""
+
+
+def init_app(app):
+    ttl = app.config.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)
+    size = app.config.get('RESPONSE_CACHE_SIZE', DEFAULT_SIZE)
+    name = app.config.get('RESPONSE_CACHE', 'memory')
+    if name == 'none':
+        backend = None
+    elif name == 'memory':
+        backend = MemoryCacheBackend(ttl, size)
+    elif name.startswith('sqlite:///'):
+        backend = SQLiteCacheBackend(name[len('sqlite:///'):], ttl, size)
+    else:
+        raise ValueError('Unknown RESPONSE_CACHE %r' % name)
+    response_cache = ResponseCache(backend)
+    app.extensions['trivia.cache'] = response_cache
+    add_listener(app, response_cache.on_change)
+    add_collector(app, lambda: [
+        ('response_cache_' + name + ('' if name == 'entries' else '_total'),
+         {}, value) for name, value in response_cache.stats().items()])
+    return response_cache
@@ -0,0 +1,395 @@
+import bisect
+import fcntl
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+
+import click
+from flask import current_app, request
+
+from models import db, add_listener, Question, Category
+from flaskr import pagination
+from flaskr.draw import as_key
+from flaskr.fields import QUESTION_FIELDS
+
+MAGIC = b'TRIVCAT1'
+ALL = 0
+NONE = -1
+MAX_ATTEMPTS = 32
+REBUILD_DELAY = 1.0
+
+# Every section is a flat array (typecode) or the UTF-8 string blob (None).
+SECTIONS = (
+    ('category_ids', 'i'),
+    ('category_types', 'i'),
+    ('category_starts', 'i'),
+    ('category_ends', 'i'),
+    ('ids', 'i'),
+    ('categories', 'i'),
+    ('difficulties', 'i'),
+    ('questions', 'i'),
+    ('answers', 'i'),
+    ('ordered_ids', 'i'),
+    ('ordered_positions', 'i'),
+    ('string_offsets', 'q'),
+    ('strings', None),
+)
+HEADER = struct.Struct('<8s16sQII' + 'QQ' * len(SECTIONS))
+
+
+class Snapshot(object):
+    """
+    Read-only view of a catalog file.
+
+    Questions are stored in (category, id) order as parallel int32 arrays,
+    so a category is one contiguous [start, end) range; ordered_ids and
+    ordered_positions give the global id order. Text columns are indexes
+    into a table of interned strings. Everything is a memoryview over a
+    shared read-only mmap, so workers hold no private copy of the data and
+    only the strings a response uses are ever decoded.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        fields = HEADER.unpack_from(view)
+        if fields[0] != MAGIC:
+            raise ValueError('%s is not a question catalog' % path)
+        self.stamp = (fields[1].rstrip(b'\0').decode(), fields[2])
+        self.category_count, self.question_count = fields[3], fields[4]
+        for number, (name, typecode) in enumerate(SECTIONS):
+            offset, length = fields[5 + 2 * number:7 + 2 * number]
+            section = view[offset:offset + length]
+            setattr(self, '_' + name,
+                    section.cast(typecode) if typecode else section)
+
+    def categories(self):
+        return {
+            category_id: self._string(self._category_types[number])
+            for number, category_id in enumerate(self._category_ids)}
+
+    def category_type(self, category):
+        number = self._category_number(category)
+        if number is None:
+            return None
+        return self._string(self._category_types[number])
+
+    def count(self, category=ALL):
+        start, end = self._range(category)
+        return end - start
+
+    def question(self, position, fields=QUESTION_FIELDS):
+        """
+        The question at position as a dict of fields. Only the text fields
+        asked for are decoded.
+        """
+        return dict((field, self._READERS[field](self, position))
+                    for field in fields)
+
+    _READERS = {
+        'id': lambda self, position: self._ids[position],
+        'question': lambda self, position: self._string(
+            self._questions[position]),
+        'answer': lambda self, position: self._string(
+            self._answers[position]),
+        'category': lambda self, position: _value(
+            self._categories[position]),
+        'difficulty': lambda self, position: _value(
+            self._difficulties[position]),
+    }
+
+    def page(self, category=ALL, per_page=10, offset=0, last_id=None,
+             fields=QUESTION_FIELDS):
+        """
+        Returns (questions, more) for per_page questions of category in id
+        order, starting after last_id if given and at offset otherwise.
+        """
+        if as_key(category) == ALL:
+            ids, positions = self._ordered_ids, self._ordered_positions
+            start, end = 0, self.question_count
+        else:
+            ids, positions = self._ids, None
+            start, end = self._range(category)
+        if last_id is not None:
+            start = bisect.bisect_right(ids, last_id, start, end)
+        else:
+            start = min(start + offset, end)
+        stop = min(start + per_page, end)
+        questions = [
+            self.question(positions[number] if positions else number, fields)
+            for number in range(start, stop)]
+        return questions, stop < end
+
+    def draw(self, category=ALL, exclude=()):
+        """Returns a random question of category not in exclude, or None."""
+        exclude = set(as_key(question_id) for question_id in exclude)
+        start, end = self._range(category)
+        if start == end:
+            return None
+        for _ in range(MAX_ATTEMPTS):
+            position = random.randrange(start, end)
+            if self._ids[position] not in exclude:
+                return self.question(position)
+        # Mostly exhausted; fall back to the remaining candidates.
+        remaining = [position for position in range(start, end)
+                     if self._ids[position] not in exclude]
+        if not remaining:
+            return None
+        return self.question(random.choice(remaining))
+
+    def _category_number(self, category):
+        category = as_key(category)
+        number = bisect.bisect_left(self._category_ids, category)
+        if number < self.category_count and \
+                self._category_ids[number] == category:
+            return number
+        return None
+
+    def _range(self, category):
+        if as_key(category) == ALL:
+            return 0, self.question_count
+        number = self._category_number(category)
+        if number is None:
+            return 0, 0
+        return self._category_starts[number], self._category_ends[number]
+
+    def _string(self, number):
+        return str(self._strings[
+            self._string_offsets[number]:self._string_offsets[number + 1]],
+            'utf-8')
+
+
+def _value(key):
+    return None if key == NONE else key
+
+
+def write(path, stamp, categories, questions):
+    """
+    Writes a catalog of categories [(id, type)] and questions
+    [(id, category, difficulty, question, answer)] stamped with the
+    (nonce, version) it was read at. The file is built next to path and
+    moved over it with os.replace, so readers see the old or the new
+    snapshot and never a partial one.
+    """
+    strings, interned = [], {}
+
+    def intern(value):
+        value = value or ''
+        if value not in interned:
+            interned[value] = len(strings)
+            strings.append(value.encode('utf-8'))
+        return interned[value]
+
+    def key(value):
+        value = as_key(value)
+        return value if isinstance(value, int) else NONE
+
+    categories = sorted((key(category_id), category_type)
+                        for category_id, category_type in categories)
+    questions = sorted(
+        (key(category), question_id, key(difficulty), question, answer)
+        for question_id, category, difficulty, question, answer in questions)
+
+    sections = dict((name, array(typecode)) for name, typecode in SECTIONS
+                    if typecode)
+    for category, question_id, difficulty, question, answer in questions:
+        sections['ids'].append(question_id)
+        sections['categories'].append(category)
+        sections['difficulties'].append(difficulty)
+        sections['questions'].append(intern(question))
+        sections['answers'].append(intern(answer))
+
+    ordered = sorted(range(len(questions)), key=sections['ids'].__getitem__)
+    sections['ordered_positions'].extend(ordered)
+    sections['ordered_ids'].extend(sections['ids'][p] for p in ordered)
+
+    keys = sections['categories']
+    for category_id, category_type in categories:
+        sections['category_ids'].append(category_id)
+        sections['category_types'].append(intern(category_type))
+        sections['category_starts'].append(
+            bisect.bisect_left(keys, category_id))
+        sections['category_ends'].append(
+            bisect.bisect_right(keys, category_id))
+
+    offsets = sections['string_offsets']
+    offsets.append(0)
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    sections['strings'] = b''.join(strings)
+
+    blobs, layout, position = [], [], HEADER.size
+    for name, typecode in SECTIONS:
+        blob = sections[name] if typecode is None else \
+            sections[name].tobytes()
+        padding = -position % 8
+        blobs.append(b'\0' * padding + blob)
+        position += padding
+        layout.extend((position, len(blob)))
+        position += len(blob)
+
+    nonce, version = stamp
+    header = HEADER.pack(MAGIC, nonce.encode(), version, len(categories),
+                         len(questions), *layout)
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(temporary, path)
+
+
+class Catalog(object):
+    """
+    Keeps a worker on the newest catalog snapshot.
+
+    A snapshot is only served while its stamp matches the shared data
+    version; after a write the endpoints fall back to the database and a
+    rebuild is scheduled. Rebuilds are debounced, so a burst of writes
+    costs one rebuild, and serialized across workers with a lock file, so
+    only one worker rebuilds while the others keep reading.
+    """
+
+    def __init__(self, app, path, data_version, delay=REBUILD_DELAY):
+        self.app = app
+        self.path = path
+        self.data_version = data_version
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._file_key = None
+        self._dirty = False
+        self._worker = None
+
+    def current(self):
+        """Returns the snapshot if it is up to date, else None."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.schedule_rebuild()
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if file_key != self._file_key:
+                self._snapshot = Snapshot(self.path)
+                self._file_key = file_key
+            snapshot = self._snapshot
+        if snapshot.stamp != self.data_version.current()[:2]:
+            self.schedule_rebuild()
+            return None
+        return snapshot
+
+    def rebuild(self):
+        """
+        Builds a snapshot from the database unless another worker is
+        already doing so. Returns True if this call wrote one.
+        """
+        with open(self.path + '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            # Stamp with the version read before the data, so writes that
+            # land during the build leave the snapshot stale, not wrong.
+            stamp = self.data_version.current()[:2]
+            write(self.path, stamp,
+                  db.session.query(Category.id, Category.type),
+                  db.session.query(Question.id, Question.category,
+                                   Question.difficulty, Question.question,
+                                   Question.answer))
+            db.session.remove()
+            return True
+
+    def schedule_rebuild(self):
+        with self._lock:
+            self._dirty = True
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run)
+                self._worker.daemon = True
+                self._worker.start()
+
+    def on_change(self, action, model, records):
+        self.schedule_rebuild()
+
+    def _run(self):
+        while True:
+            time.sleep(self.delay)
+            with self._lock:
+                if not self._dirty:
+                    self._worker = None
+                    return
+                self._dirty = False
+            try:
+                with self.app.app_context():
+                    self.rebuild()
+            except Exception as e:
+                print(e)
+
+
+"""
+init_app(app)
+    attaches a Catalog when CATALOG_PATH is set; it needs the data version
+    shared through a file (see versioning) so every worker agrees on which
+    snapshot is current. Must run after versioning.init_app.
+"""
+
+
+def init_app(app):
+    path = app.config.get('CATALOG_PATH')
+    app.extensions['trivia.catalog'] = None
+    if not path:
+        return
+    data_version = app.extensions['trivia.data_version']
+    if data_version.path is None:
+        raise ValueError('CATALOG_PATH requires DATA_VERSION_FILE')
+
+    catalog = Catalog(app, path, data_version,
+                      app.config.get('CATALOG_REBUILD_DELAY', REBUILD_DELAY))
+    app.extensions['trivia.catalog'] = catalog
+    add_listener(app, catalog.on_change)
+
+    @app.cli.command('build-catalog')
+    def build_catalog_command():
+        """Write the shared question catalog snapshot."""
+        if catalog.rebuild():
+            snapshot = Snapshot(path)
+            click.echo('%d questions in %d categories' % (
+                snapshot.question_count, snapshot.category_count))
+        else:
+            click.echo('Another worker is rebuilding the catalog', err=True)
+
+
+def get_snapshot():
+    """Returns the current snapshot, or None to use the database."""
+    catalog = current_app.extensions.get('trivia.catalog')
+    if catalog is None:
+        return None
+    return catalog.current()
+
+
+def paginate(snapshot, per_page, category=ALL, fields=QUESTION_FIELDS):
+    """
+    Snapshot counterpart of pagination.paginate, with the same arguments
+    and cursors; returns (questions as dicts of fields, next_cursor).
+    """
+    scope = () if as_key(category) == ALL else (as_key(category),)
+    per_page, offset, last_id = pagination.page_args(per_page, scope)
+    questions, more = snapshot.page(
+        category, per_page, offset, last_id, fields)
+    next_cursor = None
+    if more and questions:
+        next_cursor = pagination.encode_cursor(
+            *(scope + (questions[-1]['id'],)))
+    return questions, next_cursor
+
+
+def count(snapshot, category=ALL, default='exact'):
+    """Snapshot counterpart of stats.count."""
+    if request.args.get('count', default) == 'none':
+        return None
+    return snapshot.count(category)
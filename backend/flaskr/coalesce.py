@@ -0,0 +1,127 @@
+import functools
+import threading
+
+from flask import current_app, request, Response
+
+from flaskr.metrics import add_collector
+from models import add_listener
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent GET requests.
+
+    The first request for a key runs the view; requests for the same key
+    that arrive while it is running wait for it and answer with the same
+    status, mimetype and body instead of querying the database themselves.
+    Keys are the request path and query string plus a write generation, so
+    a request that starts after a question or category write never joins a
+    flight that may have read the data from before it.
+
+    A follower that waits longer than its timeout, or whose leader failed,
+    runs the view itself.
+    """
+
+    def __init__(self, enabled=True, timeout=DEFAULT_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._generation = 0
+
+    def coalesced(self, timeout=None):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                def run():
+                    response = current_app.make_response(
+                        view(*args, **kwargs))
+                    return response, (response.status_code,
+                                      response.mimetype,
+                                      response.get_data())
+
+                key = '%d|%s' % (self._generation, request.full_path)
+                return self.do(key, run, timeout)
+            return wrapper
+        return decorator
+
+    def do(self, key, run, timeout=None):
+        """
+        Returns the response of run() for this request, or one built from
+        the (status, mimetype, body) of a concurrent run() for key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if leader:
+            try:
+                response, flight.result = run()
+                return response
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            return run()[0]
+        if flight.result is None:
+            return run()[0]
+        status, mimetype, body = flight.result
+        return Response(body, status=status, mimetype=mimetype)
+
+    def on_change(self, action, model, records):
+        with self._lock:
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._flights),
+            }
+
+
+"""
+init_app(app)
+    builds the app's SingleFlight. COALESCE = False turns coalescing off;
+    COALESCE_TIMEOUT (seconds, default 5) is how long a follower waits for
+    the leader before running the view itself, unless the route passes its
+    own timeout to coalesced().
+"""
+
+
+def init_app(app):
+    single_flight = SingleFlight(
+        app.config.get('COALESCE', True),
+        app.config.get('COALESCE_TIMEOUT', DEFAULT_TIMEOUT))
+    app.extensions['trivia.coalesce'] = single_flight
+    add_listener(app, single_flight.on_change)
+    add_collector(app, lambda: [
+        ('coalesce_' + name + ('' if name == 'in_flight' else '_total'),
+         {}, value) for name, value in single_flight.stats().items()])
+    return single_flight
@@ -0,0 +1,374 @@
+"""
+Near-duplicate question detection.
+
+Questions are compared by the Jaccard similarity of their character
+shingles, estimated with MinHash signatures and found through locality
+sensitive hashing: a signature is cut into bands, and two questions whose
+similarity is around THRESHOLD or more share at least one band with high
+probability. Signatures are computed with NumPy for a whole chunk of
+questions at a time.
+
+Requires the optional numpy package:
+
+    pip install numpy
+
+Without it nothing is flagged and `flask find-duplicates` refuses to run.
+"""
+import threading
+
+import click
+from flask import current_app
+
+from models import db, add_listener, Question
+from flaskr.search import tokenize
+from flaskr.versioning import Resync
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHINGLE = 5
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.8
+CHUNK_SIZE = 1000
+MERGE_SIZE = 4096
+MAX_TEXT = 1024
+SEED = 20190601
+
+
+def normalize(question, answer):
+    return '%s | %s' % (' '.join(tokenize(question)),
+                        ' '.join(tokenize(answer)))
+
+
+def shingles(text):
+    return set(text[i:i + SHINGLE]
+               for i in range(max(len(text) - SHINGLE + 1, 1)))
+
+
+def jaccard(a, b):
+    return len(a & b) / float(len(a | b)) if a or b else 1.0
+
+
+class MinHasher(object):
+    """
+    Computes MinHash signatures and LSH band keys for many texts at once.
+
+    The texts are joined into one byte buffer; every SHINGLE-byte window
+    is hashed with a polynomial over the buffer's columns, the windows
+    that straddle two texts are dropped, and each of the NUM_PERM
+    multiply-shift permutations is applied to all hashes in one array
+    operation before minimum.reduceat takes the per-text minimums.
+    """
+
+    def __init__(self, seed=SEED):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | \
+            np.uint64(1)
+        self.b = rng.randint(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+        self.band_weights = rng.randint(
+            1, 2 ** 63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+    def signatures(self, texts):
+        """Returns a (len(texts), NUM_PERM) uint32 array."""
+        encoded = [text.encode('utf-8')[:MAX_TEXT].ljust(SHINGLE)
+                   for text in texts]
+        lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        with np.errstate(over='ignore'):
+            windows = len(buffer) - SHINGLE + 1
+            hashes = np.zeros(windows, dtype=np.uint64)
+            for offset in range(SHINGLE):
+                hashes = hashes * np.uint64(1099511628211) + \
+                    buffer[offset:offset + windows].astype(np.uint64)
+
+            # Windows that lie entirely inside one text.
+            counts = lengths - SHINGLE + 1
+            firsts = np.cumsum(counts) - counts
+            positions = np.arange(counts.sum()) - np.repeat(firsts, counts) \
+                + np.repeat(starts, counts)
+            mixed = (hashes[positions] * np.uint64(0x9E3779B97F4A7C15)) >> \
+                np.uint64(32)
+
+            values = (mixed[:, None] * self.a[None, :] + self.b[None, :]) >> \
+                np.uint64(32)
+        return np.minimum.reduceat(values, firsts, axis=0).astype(np.uint32)
+
+    def band_keys(self, signatures):
+        """Returns a (len(signatures), BANDS) uint64 array of band hashes."""
+        bands = signatures.astype(np.uint64).reshape(-1, BANDS, ROWS)
+        with np.errstate(over='ignore'):
+            return (bands * self.band_weights).sum(axis=2, dtype=np.uint64)
+
+
+class LSHIndex(object):
+    """
+    Band keys of every question, for duplicate lookups at insert time.
+
+    The keys are kept as an (n, BANDS) matrix with one row per question id.
+    From it, each band gets a sorted uint64 array with the matching question
+    ids, so a lookup is BANDS binary searches. New questions go to a small
+    pending buffer that is scanned directly and merged into the matrix once
+    it holds MERGE_SIZE entries; replaced and deleted ids are hidden until
+    the next merge. A reload after other workers' writes builds the arrays
+    aside and replays the writes of this process that arrived meanwhile.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._rows = np.zeros(0, dtype=np.int64)
+        self._matrix = np.zeros((0, BANDS), dtype=np.uint64)
+        self._keys = np.zeros((BANDS, 0), dtype=np.uint64)
+        self._ids = np.zeros((BANDS, 0), dtype=np.int64)
+        self._pending = {}
+        self._hidden = set()
+        self._journal = None
+
+    def load(self, rows):
+        """(Re)builds the index from (id, question, answer) rows."""
+        with self._lock:
+            self._journal = []
+        fresh = LSHIndex()
+        fresh._build(*band_keys(rows))
+        with self._lock:
+            for name in ('_rows', '_matrix', '_keys', '_ids'):
+                setattr(self, name, getattr(fresh, name))
+            self._pending = {}
+            self._hidden = set()
+            for entry in self._journal:
+                self._change(*entry)
+            self._journal = None
+            self.loaded = True
+
+    def add(self, question_id, keys):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((question_id, keys))
+            if self.loaded:
+                self._change(question_id, keys)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((question_id,))
+            if self.loaded:
+                self._change(question_id)
+
+    def candidates(self, keys):
+        """Returns the ids sharing at least one band with keys."""
+        found = set()
+        with self._lock:
+            for band in range(BANDS):
+                column = self._keys[band]
+                start = np.searchsorted(column, keys[band], 'left')
+                end = np.searchsorted(column, keys[band], 'right')
+                found.update(self._ids[band][start:end].tolist())
+            found -= self._hidden
+            found.update(question_id for question_id, pending in
+                         self._pending.items() if (pending == keys).any())
+        return found
+
+    def _change(self, question_id, keys=None):
+        self._hidden.add(question_id)
+        self._pending.pop(question_id, None)
+        if keys is not None:
+            self._pending[question_id] = keys
+            if len(self._pending) >= MERGE_SIZE:
+                self._merge()
+
+    def _merge(self):
+        keep = ~np.isin(self._rows, np.fromiter(
+            self._hidden, dtype=np.int64, count=len(self._hidden)))
+        ids, keys = self._rows[keep], self._matrix[keep]
+        if self._pending:
+            ids = np.concatenate((ids, np.fromiter(
+                self._pending, dtype=np.int64, count=len(self._pending))))
+            keys = np.concatenate(
+                (keys, np.array(list(self._pending.values()))))
+        self._build(ids, keys)
+        self._pending = {}
+        self._hidden = set()
+
+    def _build(self, ids, keys):
+        self._rows = ids
+        self._matrix = np.asarray(keys, dtype=np.uint64).reshape(-1, BANDS)
+        order = np.argsort(self._matrix, axis=0, kind='stable').T
+        self._keys = np.take_along_axis(self._matrix.T, order, axis=1)
+        self._ids = ids[order]
+
+    def on_change(self, action, model, records):
+        if model != 'question':
+            return
+        if action == 'delete':
+            for record in records:
+                self.remove(record['id'])
+            return
+        hasher = get_hasher()
+        keys = hasher.band_keys(hasher.signatures(
+            [normalize(record['question'], record['answer'])
+             for record in records]))
+        for record, row in zip(records, keys):
+            self.add(record['id'], row)
+
+
+def chunked_signatures(rows, hasher, chunk_size=CHUNK_SIZE):
+    """Yields (ids, signatures) for chunks of (id, question, answer) rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _signed(chunk, hasher)
+            chunk = []
+    if chunk:
+        yield _signed(chunk, hasher)
+
+
+def band_keys(rows, hasher=None):
+    """Returns (ids, band keys) for (id, question, answer) rows."""
+    hasher = hasher or get_hasher()
+    ids, keys = [], []
+    for chunk_ids, signatures in chunked_signatures(rows, hasher):
+        ids.append(chunk_ids)
+        keys.append(hasher.band_keys(signatures))
+    if not ids:
+        return np.zeros(0, dtype=np.int64), \
+            np.zeros((0, BANDS), dtype=np.uint64)
+    return np.concatenate(ids), np.concatenate(keys)
+
+
+def _signed(chunk, hasher):
+    ids = np.array([row[0] for row in chunk], dtype=np.int64)
+    return ids, hasher.signatures(
+        [normalize(question, answer) for _, question, answer in chunk])
+
+
+def cluster(ids, signatures, threshold=THRESHOLD, hasher=None):
+    """
+    Groups near-duplicates among all the signatures. Questions that share
+    a band key are sorted next to each other; neighbours whose signatures
+    agree on at least threshold of their slots are joined with union-find.
+    Returns the clusters of two or more ids, largest first.
+    """
+    hasher = hasher or get_hasher()
+    keys = hasher.band_keys(signatures)
+    parent = list(range(len(ids)))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for band in range(BANDS):
+        order = np.argsort(keys[:, band], kind='stable')
+        same = keys[order[1:], band] == keys[order[:-1], band]
+        left, right = order[:-1][same], order[1:][same]
+        agree = (signatures[left] == signatures[right]).mean(axis=1)
+        for i, j in zip(left[agree >= threshold].tolist(),
+                        right[agree >= threshold].tolist()):
+            parent[find(i)] = find(j)
+
+    clusters = {}
+    for node in range(len(ids)):
+        clusters.setdefault(find(node), []).append(int(ids[node]))
+    return sorted((sorted(members) for members in clusters.values()
+                   if len(members) > 1), key=lambda members: -len(members))
+
+
+"""
+init_app(app)
+    attaches an LSHIndex, loaded on the first lookup, kept current through
+    the model write listeners and reloaded after other workers' writes,
+    when numpy is installed and DEDUPE is not turned off; registers the
+    find-duplicates command.
+    DEDUPE_THRESHOLD (default 0.8) is the shingle Jaccard similarity from
+    which questions count as duplicates.
+"""
+
+
+def init_app(app):
+    app.extensions['trivia.dedupe'] = None
+    if np is not None and app.config.get('DEDUPE', True):
+        index = LSHIndex()
+        app.extensions['trivia.dedupe'] = index
+        app.extensions['trivia.dedupe.resync'] = Resync(app)
+        add_listener(app, index.on_change)
+
+    @app.cli.command('find-duplicates')
+    @click.option('--threshold', type=float, default=None,
+                  help='Minimum estimated similarity (default 0.8).')
+    def find_duplicates_command(threshold):
+        """Cluster near-duplicate questions across the whole bank."""
+        if np is None:
+            raise click.ClickException('find-duplicates needs numpy')
+        threshold = threshold or app.config.get(
+            'DEDUPE_THRESHOLD', THRESHOLD)
+        hasher = get_hasher()
+        rows = db.session.query(
+            Question.id, Question.question, Question.answer) \
+            .order_by(Question.id).yield_per(CHUNK_SIZE)
+        chunks = list(chunked_signatures(rows, hasher))
+        if not chunks:
+            return
+        ids = np.concatenate([chunk_ids for chunk_ids, _ in chunks])
+        signatures = np.concatenate([signed for _, signed in chunks])
+        clusters = cluster(ids, signatures, threshold, hasher)
+        for members in clusters:
+            click.echo(' '.join(str(member) for member in members))
+        click.echo('%d clusters, %d redundant questions' % (
+            len(clusters), sum(len(members) - 1 for members in clusters)),
+            err=True)
+
+
+_hasher = None
+
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        _hasher = MinHasher()
+    return _hasher
+
+
+def get_index():
+    index = current_app.extensions.get('trivia.dedupe')
+    if index is not None:
+        current_app.extensions['trivia.dedupe.resync'].sync(
+            lambda: index.load(db.session.query(
+                Question.id, Question.question, Question.answer)))
+    return index
+
+
+def find_duplicates(question, answer, limit=10):
+    """
+    Returns the ids of up to limit stored questions at least
+    DEDUPE_THRESHOLD similar to question and answer, most similar first.
+    The LSH candidates are checked against their exact shingle sets with
+    one IN query.
+    """
+    index = get_index()
+    if index is None:
+        return []
+    text = normalize(question, answer)
+    hasher = get_hasher()
+    keys = hasher.band_keys(hasher.signatures([text]))[0]
+    candidates = index.candidates(keys)
+    if not candidates:
+        return []
+    threshold = current_app.config.get('DEDUPE_THRESHOLD', THRESHOLD)
+    target = shingles(text)
+    scored = []
+    for question_id, other_question, other_answer in db.session.query(
+            Question.id, Question.question, Question.answer).filter(
+                Question.id.in_(candidates)):
+        similarity = jaccard(
+            target, shingles(normalize(other_question, other_answer)))
+        if similarity >= threshold:
+            scored.append((-similarity, question_id))
+    return [question_id for _, question_id in sorted(scored)[:limit]]
@@ -0,0 +1,275 @@
+import random
+import threading
+
+from flask import current_app
+
+from models import db, add_listener, Question
+from flaskr.versioning import Resync
+
+
+def as_key(value):
+    """Normalizes a category or question id coming from the DB or JSON."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class DrawIndex(object):
+    """
+    Compact per-category index of question ids for the quiz endpoint.
+
+    Every category keeps a plain list of ids plus a position map, so adding
+    or removing an id is O(1) (swap with the last element and pop) and a
+    draw is a randrange on the list with a few rejection attempts for ids
+    the player has already seen. Each (category, difficulty) pair has a
+    bucket of its own as well, for stratified and weighted samples.
+
+    load() can run again to pick up other workers' writes. It builds the
+    new lists aside while draws go on, journals the writes of this process
+    that arrive meanwhile, and swaps the lists in with the journal replayed.
+    """
+
+    ALL = 0
+    MAX_ATTEMPTS = 32
+
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._positions = {}
+        self._categories = {}
+        self._journal = None
+
+    def load(self, rows):
+        with self._lock:
+            self._journal = []
+        fresh = DrawIndex()
+        for row in rows:
+            fresh._add(*[as_key(value) for value in row])
+        with self._lock:
+            self._ids = fresh._ids
+            self._positions = fresh._positions
+            self._categories = fresh._categories
+            for entry in self._journal:
+                self._remove(entry[0])
+                if len(entry) > 1:
+                    self._add(*entry)
+            self._journal = None
+            self.loaded = True
+
+    def add(self, question_id, category, difficulty=None):
+        entry = (as_key(question_id), as_key(category), as_key(difficulty))
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(entry)
+            if self.loaded:
+                self._remove(entry[0])
+                self._add(*entry)
+
+    def remove(self, question_id):
+        entry = (as_key(question_id),)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(entry)
+            if self.loaded:
+                self._remove(entry[0])
+
+    def size(self, category=ALL, difficulty=None):
+        return len(self._ids.get(self._key(category, difficulty), ()))
+
+    def difficulties(self, category=ALL):
+        """Returns the difficulties that have questions in category."""
+        category = as_key(category)
+        with self._lock:
+            return sorted(key[1] for key, ids in self._ids.items()
+                          if isinstance(key, tuple) and key[0] == category
+                          and ids)
+
+    def draw(self, category=ALL, exclude=()):
+        exclude = set(as_key(question_id) for question_id in exclude)
+        with self._lock:
+            ids = self._ids.get(as_key(category))
+            if not ids:
+                return None
+            if len(exclude) < len(ids):
+                for _ in range(self.MAX_ATTEMPTS):
+                    candidate = ids[random.randrange(len(ids))]
+                    if candidate not in exclude:
+                        return candidate
+            # Only reached when most of the bucket has been seen, so the
+            # exclude set is at least as large as the bucket.
+            remaining = [i for i in ids if i not in exclude]
+            return random.choice(remaining) if remaining else None
+
+    def sample(self, category=ALL, count=1, exclude=(), difficulty=None):
+        """Returns up to count distinct random ids not in exclude."""
+        exclude = set(as_key(question_id) for question_id in exclude)
+        with self._lock:
+            ids = self._ids.get(self._key(category, difficulty), ())
+            picked = []
+            seen = set()
+            attempts = 0
+            while len(picked) < count and attempts < self.MAX_ATTEMPTS * count:
+                attempts += 1
+                if len(seen) + len(exclude) >= len(ids):
+                    break
+                candidate = ids[random.randrange(len(ids))]
+                if candidate not in exclude and candidate not in seen:
+                    seen.add(candidate)
+                    picked.append(candidate)
+            if len(picked) < count:
+                remaining = [i for i in ids
+                             if i not in exclude and i not in seen]
+                picked.extend(random.sample(
+                    remaining, min(count - len(picked), len(remaining))))
+            return picked
+
+    def sample_by_difficulty(self, category=ALL, count=1, exclude=(),
+                             weights=None):
+        """
+        Returns up to count distinct random ids not in exclude, split
+        across difficulties in proportion to weights ({difficulty: weight};
+        evenly over every difficulty of the category when None). Shares
+        are rounded by largest remainder, and a difficulty that runs out
+        hands what it could not fill to the others.
+        """
+        exclude = set(as_key(question_id) for question_id in exclude)
+        if weights is None:
+            weights = dict.fromkeys(self.difficulties(category), 1)
+        weights = dict((as_key(difficulty), weight)
+                       for difficulty, weight in weights.items()
+                       if weight > 0)
+        picked = []
+        while weights and len(picked) < count:
+            wanted = count - len(picked)
+            total = float(sum(weights.values()))
+            shares = dict((difficulty, wanted * weight / total)
+                          for difficulty, weight in weights.items())
+            quotas = dict((difficulty, int(share))
+                          for difficulty, share in shares.items())
+            # Largest remainders first, ties broken at random.
+            leftover = sorted(weights, key=lambda difficulty: (
+                quotas[difficulty] - shares[difficulty], random.random()))
+            for difficulty in leftover[:wanted - sum(quotas.values())]:
+                quotas[difficulty] += 1
+            for difficulty, quota in quotas.items():
+                if not quota:
+                    continue
+                ids = self.sample(category, quota, exclude, difficulty)
+                exclude.update(ids)
+                picked.extend(ids)
+                if len(ids) < quota:
+                    del weights[difficulty]
+        random.shuffle(picked)
+        return picked
+
+    def on_change(self, action, model, records):
+        if model != 'question':
+            return
+        for record in records:
+            if action == 'delete':
+                self.remove(record['id'])
+            else:
+                self.add(record['id'], record['category'],
+                         record['difficulty'])
+
+    def _key(self, category, difficulty=None):
+        category = as_key(category)
+        return category if difficulty is None else \
+            (category, as_key(difficulty))
+
+    def _add(self, question_id, category, difficulty=None):
+        self._categories[question_id] = (category, difficulty)
+        keys = [self.ALL, category]
+        if difficulty is not None:
+            keys.extend([(self.ALL, difficulty), (category, difficulty)])
+        for key in keys:
+            ids = self._ids.setdefault(key, [])
+            self._positions.setdefault(key, {})[question_id] = len(ids)
+            ids.append(question_id)
+
+    def _remove(self, question_id):
+        if question_id not in self._categories:
+            return
+        category, difficulty = self._categories.pop(question_id)
+        keys = [self.ALL, category]
+        if difficulty is not None:
+            keys.extend([(self.ALL, difficulty), (category, difficulty)])
+        for key in keys:
+            ids = self._ids[key]
+            positions = self._positions[key]
+            position = positions.pop(question_id)
+            last = ids.pop()
+            if last != question_id:
+                ids[position] = last
+                positions[last] = position
+
+
+"""
+init_app(app)
+    attaches an empty DrawIndex to the app; it is filled on the first draw,
+    kept current through the model write listeners and reloaded after
+    other workers' writes (see versioning.Resync)
+"""
+
+
+def init_app(app):
+    index = DrawIndex()
+    app.extensions['trivia.draw'] = index
+    app.extensions['trivia.draw.resync'] = Resync(app)
+    add_listener(app, index.on_change)
+
+
+def get_index():
+    index = current_app.extensions['trivia.draw']
+    current_app.extensions['trivia.draw.resync'].sync(
+        lambda: index.load(db.session.query(
+            Question.id, Question.category, Question.difficulty)))
+    return index
+
+
+def draw_question(category, exclude=()):
+    """Returns a random Question from category not in exclude, or None."""
+    index = get_index()
+    while True:
+        question_id = index.draw(category, exclude)
+        if question_id is None:
+            return None
+        question = Question.query.get(question_id)
+        if question is not None:
+            return question
+        # Deleted by another worker since the index was loaded.
+        index.remove(question_id)
+
+
+def draw_questions(category, count, exclude=(), difficulty=None):
+    """
+    Returns up to count distinct random Questions from category not in
+    exclude, loaded with one IN query. difficulty None samples uniformly,
+    'stratified' spreads the questions evenly over the difficulties and a
+    {difficulty: weight} dict splits them in proportion to the weights.
+    """
+    index = get_index()
+    exclude = set(as_key(question_id) for question_id in exclude)
+    questions = []
+    while len(questions) < count:
+        wanted = count - len(questions)
+        if difficulty is None:
+            ids = index.sample(category, wanted, exclude)
+        else:
+            ids = index.sample_by_difficulty(
+                category, wanted, exclude,
+                None if difficulty == 'stratified' else difficulty)
+        if not ids:
+            break
+        exclude.update(ids)
+        found = dict((question.id, question) for question in
+                     Question.query.filter(Question.id.in_(ids)))
+        questions.extend(found[i] for i in ids if i in found)
+        if len(found) == len(ids):
+            break
+        # Deleted by another worker since the index was loaded.
+        for question_id in set(ids) - set(found):
+            index.remove(question_id)
+    return questions
@@ -0,0 +1,44 @@
+"""
+Sparse fieldsets for the question listings.
+
+?fields=id,question,difficulty limits the questions of a response to the
+named fields. The projection is pushed down into SQL: listings select only
+those columns as plain row tuples, which skips building ORM entities and
+the identity map, and serialize() turns the rows into dicts with one zip
+per row. Without ?fields= every field is returned, through the same path.
+"""
+from flask import request
+
+from models import db, Question
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def requested(default=QUESTION_FIELDS):
+    """
+    Returns the fields named by ?fields= in QUESTION_FIELDS order, always
+    including id, which the cursors need. Raises ValueError for an unknown
+    field.
+    """
+    return parse(request.args.get('fields'), default)
+
+
+def parse(names, default=QUESTION_FIELDS):
+    """requested() for a comma separated string of field names."""
+    if not names:
+        return default
+    names = set(name.strip() for name in names.split(',') if name.strip())
+    unknown = names.difference(QUESTION_FIELDS)
+    if unknown:
+        raise ValueError('Unknown field %s' % ', '.join(sorted(unknown)))
+    names.add('id')
+    return tuple(field for field in QUESTION_FIELDS if field in names)
+
+
+def select(fields=QUESTION_FIELDS):
+    """A query for just the columns of fields, returning row tuples."""
+    return db.session.query(*[getattr(Question, field) for field in fields])
+
+
+def serialize(rows, fields=QUESTION_FIELDS):
+    return [dict(zip(fields, row)) for row in rows]
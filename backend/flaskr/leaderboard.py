@@ -0,0 +1,351 @@
+import datetime
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from flaskr.metrics import add_collector
+from models import db, LeaderboardEntry, QuizResult
+
+ALL = 0
+MAX_LEVEL = 24
+FLUSH_INTERVAL = 1.0
+BATCH_SIZE = 500
+# Other workers' rows are picked up by updated_at; look back this far so a
+# row committed late with an earlier timestamp is not missed.
+SYNC_SLACK = 5.0
+
+
+class _Node(object):
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class SkipList(object):
+    """
+    Sorted list of unique keys with O(log n) insert, remove, rank and
+    slicing. Every link also records how many positions it skips, so a
+    search counts the entries it passes over on its way down.
+    """
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+        self._head = _Node(None, MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _path(self, key):
+        """Returns the last node before key on every level, and its rank."""
+        update, ranks = [None] * MAX_LEVEL, [0] * MAX_LEVEL
+        node, position = self._head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level], ranks[level] = node, position
+        return update, ranks
+
+    def insert(self, key):
+        update, ranks = self._path(key)
+        position = ranks[0]
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < 0.5:
+            level += 1
+        node = _Node(key, level)
+        for number in range(level):
+            previous = update[number]
+            node.next[number] = previous.next[number]
+            previous.next[number] = node
+            node.width[number] = \
+                ranks[number] + previous.width[number] - position
+            previous.width[number] = position + 1 - ranks[number]
+        for number in range(level, MAX_LEVEL):
+            update[number].width[number] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for number in range(MAX_LEVEL):
+            previous = update[number]
+            if previous.next[number] is node:
+                previous.width[number] += node.width[number] - 1
+                previous.next[number] = node.next[number]
+            else:
+                previous.width[number] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """Returns the 0-based position of key, or None."""
+        update, ranks = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return None
+        return ranks[0]
+
+    def slice(self, start, count):
+        """Returns up to count keys from position start on."""
+        node, position = self._head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and \
+                    position + node.width[level] <= start:
+                position += node.width[level]
+                node = node.next[level]
+        keys = []
+        node = node.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Board(object):
+    """
+    Best game of every player in one category, ranked by score, then by
+    the shorter duration, then by name.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.ranking = SkipList()
+
+    def update(self, player, score, duration):
+        """Keeps the game if it beats the player's best; returns True if so."""
+        key = (-score, duration, player)
+        current = self.entries.get(player)
+        if current is not None:
+            if current <= key:
+                return False
+            self.ranking.remove(current)
+        self.entries[player] = key
+        self.ranking.insert(key)
+        return True
+
+    def rank(self, player):
+        key = self.entries.get(player)
+        if key is None:
+            return None
+        return self.ranking.rank(key) + 1, -key[0], key[1]
+
+    def top(self, limit, offset=0):
+        return [(offset + number + 1, player, -score, duration)
+                for number, (score, duration, player) in enumerate(
+                    self.ranking.slice(offset, limit))]
+
+
+class Leaderboards(object):
+    """
+    Live per-category leaderboards of completed quizzes.
+
+    record() ranks a game in memory at once and queues it; a background
+    thread appends the queued games to quiz_results and upserts the
+    leaderboard rows they improved, BATCH_SIZE at a time, every
+    FLUSH_INTERVAL seconds or as soon as a full batch is waiting. The same
+    pass, which runs even when nothing is queued, reads back the
+    leaderboard rows other workers wrote since the last one, so every
+    worker converges on the same standings, including one that only
+    serves reads. The thread starts with the first read or record.
+    """
+
+    def __init__(self, app, interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.loaded = False
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._boards = {}
+        self._pending = []
+        self._dirty = set()
+        self._synced = 0.0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def top(self, category, limit, offset=0):
+        """Returns ([(rank, player, score, duration)], players)."""
+        with self._lock:
+            board = self._boards.get(category) or Board()
+            return board.top(limit, offset), len(board.entries)
+
+    def rank(self, category, player):
+        """Returns (rank, score, duration) of player, or None."""
+        with self._lock:
+            board = self._boards.get(category)
+            return board.rank(player) if board is not None else None
+
+    def record(self, player, category, score, questions, duration):
+        """Ranks a game and queues it; returns (rank, score, duration)."""
+        with self._lock:
+            board = self._boards.setdefault(category, Board())
+            if board.update(player, score, duration):
+                self._dirty.add((category, player))
+            self._pending.append({
+                'player': player, 'category': category, 'score': score,
+                'questions': questions, 'duration': duration,
+                'created_at': datetime.datetime.utcnow()})
+            self.recorded += 1
+            full = len(self._pending) >= self.batch_size
+            best = board.rank(player)
+        self.start()
+        if full:
+            self._wake.set()
+        return best
+
+    def load(self):
+        """Reads leaderboard rows written since the last load."""
+        since = max(self._synced - SYNC_SLACK, 0.0)
+        rows = db.session.query(
+            LeaderboardEntry.category, LeaderboardEntry.player,
+            LeaderboardEntry.score, LeaderboardEntry.duration,
+            LeaderboardEntry.updated_at).filter(
+                LeaderboardEntry.updated_at >= since).all()
+        db.session.rollback()
+        with self._lock:
+            for category, player, score, duration, updated_at in rows:
+                self._boards.setdefault(category, Board()).update(
+                    player, score, duration)
+                self._synced = max(self._synced, updated_at)
+            self.loaded = True
+
+    def flush(self):
+        """Writes the queued games; returns how many were written."""
+        with self._flush_lock, self.app.app_context():
+            with self._lock:
+                pending, self._pending = self._pending[:self.batch_size], \
+                    self._pending[self.batch_size:]
+                dirty, self._dirty = self._dirty, set()
+                now = time.time()
+                best = [{'category': category, 'player': player,
+                         'score': -key[0], 'duration': key[1],
+                         'updated_at': now}
+                        for category, player in sorted(dirty)
+                        for key in [self._boards[category].entries[player]]]
+            try:
+                if pending:
+                    db.session.execute(QuizResult.__table__.insert(), pending)
+                if best:
+                    db.session.execute(text(
+                        'INSERT INTO leaderboard '
+                        '(category, player, score, duration, updated_at) '
+                        'VALUES (:category, :player, :score, :duration, '
+                        ':updated_at) '
+                        'ON CONFLICT (category, player) DO UPDATE '
+                        'SET score = excluded.score, '
+                        'duration = excluded.duration, '
+                        'updated_at = excluded.updated_at '
+                        'WHERE excluded.score > leaderboard.score '
+                        'OR (excluded.score = leaderboard.score '
+                        'AND excluded.duration < leaderboard.duration)'),
+                        best)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._pending[:0] = pending
+                    self._dirty |= dirty
+                raise
+            finally:
+                db.session.remove()
+            self.load()
+            db.session.remove()
+            return len(pending)
+
+    def start(self):
+        """Starts the flusher thread unless it is running."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        """Stops the flusher thread after one last flush."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            stopped = self._stopped.is_set()
+            try:
+                while self.flush() >= self.batch_size:
+                    pass
+            except Exception as e:
+                print(e)
+            if stopped:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {'recorded': self.recorded, 'pending': len(self._pending)}
+
+
+"""
+init_app(app)
+    attaches the app's Leaderboards. LEADERBOARD_FLUSH_INTERVAL (seconds,
+    default 1) and LEADERBOARD_BATCH_SIZE (default 500) set how queued
+    results are written to quiz_results and leaderboard.
+"""
+
+
+def init_app(app):
+    leaderboards = Leaderboards(
+        app, app.config.get('LEADERBOARD_FLUSH_INTERVAL', FLUSH_INTERVAL),
+        app.config.get('LEADERBOARD_BATCH_SIZE', BATCH_SIZE))
+    app.extensions['trivia.leaderboards'] = leaderboards
+    add_collector(app, lambda: [
+        ('quiz_results_recorded_total', {}, leaderboards.recorded),
+        ('quiz_results_pending', {}, leaderboards.stats()['pending'])])
+    return leaderboards
+
+
+def get_leaderboards():
+    leaderboards = current_app.extensions['trivia.leaderboards']
+    if not leaderboards.loaded:
+        leaderboards.load()
+    leaderboards.start()
+    return leaderboards
+
+
+def validate(data):
+    """
+    Returns ((player, category, score, questions, duration), None) for a
+    well-formed result, or (None, error).
+    """
+    player = data.get('player')
+    if not isinstance(player, str) or not player.strip():
+        return None, 'player is required'
+    player = player.strip()
+    if len(player) > 64:
+        return None, 'player must be at most 64 characters'
+    try:
+        category = int(data.get('category') or ALL)
+        score = int(data.get('score'))
+        questions = int(data.get('questions'))
+        duration = round(float(data.get('duration')), 3)
+    except (TypeError, ValueError):
+        return None, 'category, score, questions and duration must be numbers'
+    if category < 0:
+        return None, 'category must not be negative'
+    if questions < 1:
+        return None, 'questions must be at least 1'
+    if not 0 <= score <= questions:
+        return None, 'score must be between 0 and questions'
+    if not 0 <= duration < float('inf'):
+        return None, 'duration must be a positive number of seconds'
+    return (player, category, score, questions, duration), None
@@ -0,0 +1,184 @@
+import bisect
+import collections
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+DEFAULT_SLOW_QUERY_SECONDS = 0.1
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """
+    Per-route request latency histograms and SQL counters, rendered in the
+    Prometheus text format. Recording a request is a handful of dict
+    updates under one lock, cheap enough to leave on under load.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = collections.defaultdict(Histogram)
+        self.counters = collections.defaultdict(float)
+        self.collectors = []
+
+    def observe_request(self, route, method, seconds, sql):
+        labels = (('route', route), ('method', method))
+        with self._lock:
+            self.latency[labels].observe(seconds)
+            self.counters['sql_statements_total', labels] += sql['count']
+            self.counters['sql_duration_seconds_total', labels] += \
+                sql['seconds']
+            self.counters['sql_slow_statements_total', labels] += \
+                sql['slow']
+            self.counters['sql_n_plus_one_total', labels] += \
+                sql['n_plus_one']
+
+    def render(self):
+        lines = [
+            '# HELP trivia_request_duration_seconds Request latency by route.',
+            '# TYPE trivia_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            for labels, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append('trivia_request_duration_seconds_bucket%s %d' % (
+                        _labels(labels + (('le', bound),)), cumulative))
+                lines.append('trivia_request_duration_seconds_sum%s %f' % (
+                    _labels(labels), histogram.sum))
+                lines.append('trivia_request_duration_seconds_count%s %d' % (
+                    _labels(labels), cumulative))
+            samples = collections.defaultdict(list)
+            for (name, labels), value in sorted(self.counters.items()):
+                samples[name].append((labels, value))
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                samples[name].append((tuple(sorted(labels.items())), value))
+        for name, values in sorted(samples.items()):
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append('# TYPE trivia_%s %s' % (name, kind))
+            for labels, value in values:
+                lines.append('trivia_%s%s %s' % (
+                    name, _labels(labels), _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in pairs)
+
+
+def _number(value):
+    return '%d' % value if float(value).is_integer() else '%f' % value
+
+
+def add_collector(app, collector):
+    """
+    Registers collector() -> [(name, labels dict, value)] whose samples are
+    appended to /metrics; names ending in _total are exported as counters.
+    """
+    app.extensions.setdefault('trivia.collectors', []).append(collector)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('trivia.query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('trivia.query_start'):
+        connection.info['trivia.query_start'].pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['trivia.query_start'].pop()
+    if not has_request_context() or 'sql' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    sql = g.sql
+    sql['count'] += 1
+    sql['seconds'] += elapsed
+    sql['statements'][statement] += 1
+    if elapsed >= current_app.config.get(
+            'SLOW_QUERY_SECONDS', DEFAULT_SLOW_QUERY_SECONDS):
+        sql['slow'] += 1
+        current_app.logger.warning(
+            'Slow query (%.1f ms) in %s: %s',
+            elapsed * 1e3, request.path, statement)
+
+
+def render():
+    """The /metrics response in the Prometheus text format."""
+    return Response(current_app.extensions['trivia.metrics'].render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+"""
+init_app(app)
+    records latency and SQL statistics for every request, for render() to
+    expose. SLOW_QUERY_SECONDS and N_PLUS_ONE_THRESHOLD tune what is
+    flagged; METRICS_SERVER_TIMING adds a Server-Timing header.
+"""
+
+
+def init_app(app):
+    metrics = Metrics()
+    metrics.collectors = app.extensions.setdefault('trivia.collectors', [])
+    app.extensions['trivia.metrics'] = metrics
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.sql = {'count': 0, 'seconds': 0.0, 'slow': 0, 'n_plus_one': 0,
+                 'statements': collections.Counter()}
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        sql = g.sql
+        threshold = app.config.get(
+            'N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+        for statement, count in sql['statements'].items():
+            if count >= threshold:
+                # Counts the request once, however many statements repeat.
+                sql['n_plus_one'] = 1
+                app.logger.warning(
+                    'Possible N+1: %d executions in %s of %s',
+                    count, request.path, statement)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, elapsed, sql)
+        if app.config.get('METRICS_SERVER_TIMING'):
+            response.headers['Server-Timing'] = \
+                'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (
+                    sql['seconds'] * 1e3, sql['count'], elapsed * 1e3)
+        return response
+
+    return metrics
@@ -0,0 +1,67 @@
+import base64
+import binascii
+import json
+
+from flask import request
+from models import Question
+
+MAX_PER_PAGE = 100
+
+
+def encode_cursor(*values):
+    """Opaque cursor for the key of the last row of a page."""
+    payload = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError('Malformed cursor')
+    if not isinstance(values, list) or not values or \
+            not all(isinstance(value, int) for value in values):
+        raise ValueError('Malformed cursor')
+    return tuple(values)
+
+
+def page_args(per_page, scope=()):
+    """
+    Parses ?limit=, ?after= and ?page= into (per_page, offset, last_id).
+    last_id is None in offset mode. Raises ValueError for a cursor that is
+    malformed or from another listing.
+    """
+    per_page = max(1, min(
+        request.args.get('limit', per_page, type=int), MAX_PER_PAGE))
+    after = request.args.get('after')
+    if after:
+        key = decode_cursor(after)
+        if key[:-1] != tuple(scope):
+            raise ValueError('Cursor does not belong to this listing')
+        return per_page, 0, key[-1]
+    page = max(request.args.get('page', 1, type=int), 1)
+    return per_page, (page - 1) * per_page, None
+
+
+def paginate(query, per_page, scope=()):
+    """
+    Returns (questions, next_cursor) for one page of query in id order.
+
+    ?after=<cursor> seeks straight past the last row of the previous page
+    on the (scope..., id) key, so every page costs the same; ?page=N keeps
+    the old offset paging. next_cursor is None on the last page.
+    """
+    per_page, offset, last_id = page_args(per_page, scope)
+    query = query.order_by(Question.id)
+    if last_id is not None:
+        query = query.filter(Question.id > last_id)
+    else:
+        query = query.offset(offset)
+
+    questions = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(questions) > per_page:
+        questions = questions[:per_page]
+        next_cursor = encode_cursor(*(tuple(scope) + (questions[-1].id,)))
+    return questions, next_cursor
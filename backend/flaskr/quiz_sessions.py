@@ -0,0 +1,163 @@
+import collections
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+from flaskr import draw
+
+DEFAULT_TTL = 3600
+DEFAULT_DECK_SIZE = 50
+DEFAULT_MAX_SESSIONS = 100000
+
+
+class MemorySessionStore(object):
+    """
+    In-process quiz session store.
+
+    Sessions live in an OrderedDict kept in expiry order, so eviction only
+    ever looks at the oldest entries.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+
+    def create(self, token, deck):
+        with self._lock:
+            self._evict(time.time())
+            self._sessions[token] = [deck, 0, time.time() + self.ttl]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def next(self, token, count=1):
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            deck, position, _ = entry
+            entry[1] = position + count
+            entry[2] = now + self.ttl
+            self._sessions.move_to_end(token)
+            return deck[position:position + count]
+
+    def _evict(self, now):
+        while self._sessions:
+            token, entry = next(iter(self._sessions.items()))
+            if entry[2] > now:
+                break
+            del self._sessions[token]
+
+
+class SQLiteSessionStore(object):
+    """
+    Quiz session store backed by a local SQLite file, shared by every worker
+    on the host. Cards are stored one row per position so advancing a
+    session reads only the rows it returns.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS quiz_sessions ('
+                'token TEXT PRIMARY KEY, position INTEGER NOT NULL, '
+                'size INTEGER NOT NULL, expires REAL NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS quiz_session_cards ('
+                'token TEXT NOT NULL, position INTEGER NOT NULL, '
+                'question_id INTEGER NOT NULL, '
+                'PRIMARY KEY (token, position)) WITHOUT ROWID')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS quiz_sessions_expires '
+                'ON quiz_sessions (expires)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def create(self, token, deck):
+        now = time.time()
+        with self._connect() as conn:
+            self._evict(conn, now)
+            conn.execute(
+                'INSERT INTO quiz_sessions VALUES (?, 0, ?, ?)',
+                (token, len(deck), now + self.ttl))
+            conn.executemany(
+                'INSERT INTO quiz_session_cards VALUES (?, ?, ?)',
+                [(token, position, question_id)
+                 for position, question_id in enumerate(deck)])
+
+    def next(self, token, count=1):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT position FROM quiz_sessions '
+                'WHERE token = ? AND expires > ?', (token, now)).fetchone()
+            if row is None:
+                return None
+            position = row[0]
+            conn.execute(
+                'UPDATE quiz_sessions SET position = ?, expires = ? '
+                'WHERE token = ?', (position + count, now + self.ttl, token))
+            return [question_id for question_id, in conn.execute(
+                'SELECT question_id FROM quiz_session_cards '
+                'WHERE token = ? AND position >= ? AND position < ? '
+                'ORDER BY position', (token, position, position + count))]
+
+    def _evict(self, conn, now):
+        expired = 'SELECT token FROM quiz_sessions WHERE expires <= ?'
+        conn.execute(
+            'DELETE FROM quiz_session_cards WHERE token IN (%s)' % expired,
+            (now,))
+        conn.execute('DELETE FROM quiz_sessions WHERE expires <= ?', (now,))
+
+
+"""
+init_app(app)
+    picks the session store from QUIZ_SESSION_STORE: 'memory' (default) or
+    'sqlite:///path/to/file.db'
+"""
+
+
+def init_app(app):
+    ttl = app.config.get('QUIZ_SESSION_TTL', DEFAULT_TTL)
+    backend = app.config.get('QUIZ_SESSION_STORE', 'memory')
+    if backend.startswith('sqlite:///'):
+        store = SQLiteSessionStore(backend[len('sqlite:///'):], ttl=ttl)
+    elif backend == 'memory':
+        store = MemorySessionStore(ttl=ttl)
+    else:
+        raise ValueError('Unknown QUIZ_SESSION_STORE %r' % backend)
+    app.extensions['trivia.quiz_sessions'] = store
+
+
+def start_session(category, size=None):
+    """Shuffles a deck for category and returns (token, deck size)."""
+    if size is None:
+        size = current_app.config.get('QUIZ_DECK_SIZE', DEFAULT_DECK_SIZE)
+    deck = draw.get_index().sample(category, size)
+    if not deck:
+        return None, 0
+    token = secrets.token_urlsafe(16)
+    current_app.extensions['trivia.quiz_sessions'].create(token, deck)
+    return token, len(deck)
+
+
+def next_question_ids(token, count=1):
+    """Returns the next ids of the session deck, or None if it expired."""
+    return current_app.extensions['trivia.quiz_sessions'].next(token, count)
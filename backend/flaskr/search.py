@@ -0,0 +1,304 @@
+import array
+import bisect
+import heapq
+import re
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+
+from models import db, add_listener, Question
+from flaskr.fields import QUESTION_FIELDS, select
+from flaskr.versioning import Resync
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Prefixes matching more terms than this have their completions cached.
+SUGGEST_SCAN_LIMIT = 256
+MAX_SUGGESTIONS = 20
+
+# The GIN index in migrations/v007_simple_search_config.py is built on
+# this exact expression; change both together. 'simple' keeps stopwords and
+# does not stem, so Postgres matches the same whole words as the in-process
+# index. Queries must use the same configuration.
+PG_CONFIG = 'simple'
+PG_DOCUMENT = ("to_tsvector('%s', coalesce(question, '') || ' ' || "
+               "coalesce(answer, ''))" % PG_CONFIG)
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or '').lower())
+
+
+def document_terms(record):
+    return tokenize(record['question']) + tokenize(record['answer'])
+
+
+class InvertedIndex(object):
+    """
+    In-process inverted index over question and answer text.
+
+    Each term maps to a sorted array of question ids. Queries are AND-ed:
+    the shortest posting list is walked and the others are probed with
+    bisect. Every hit contains every query term, so hits are ranked by
+    document length, shortest (most focused) first. The distinct terms of
+    each question are kept too, so replacing or removing it only touches
+    its own posting lists.
+
+    The terms are also kept in a sorted list for search-as-you-type: the
+    completions of a prefix are a contiguous slice found with bisect,
+    ranked by how many questions use them. Prefixes short enough to match
+    many terms keep their top completions in a cache. A term that gains a
+    question is merged into the cached lists of its prefixes; one that
+    loses a question evicts the lists it appears in, since its successor
+    is unknown.
+
+    load() can run again to pick up other workers' writes: the new index
+    is built aside while queries go on, and the writes of this process
+    that arrive meanwhile are journaled and replayed on it.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._lengths = {}
+        self._documents = {}
+        self._terms = []
+        self._suggestions = {}
+        self._journal = None
+
+    def load(self, rows):
+        with self._lock:
+            self._journal = []
+        fresh = InvertedIndex()
+        fresh._terms = None
+        for question_id, question, answer in rows:
+            fresh._add(question_id, tokenize(question) + tokenize(answer))
+        fresh._terms = sorted(fresh._postings)
+        with self._lock:
+            self._postings = fresh._postings
+            self._lengths = fresh._lengths
+            self._documents = fresh._documents
+            self._terms = fresh._terms
+            self._suggestions = {}
+            for entry in self._journal:
+                self._remove(entry[0])
+                if len(entry) > 1:
+                    self._add(*entry)
+            self._journal = None
+            self.loaded = True
+
+    def add(self, record):
+        entry = (record['id'], document_terms(record))
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(entry)
+            if self.loaded:
+                self._remove(entry[0])
+                self._add(*entry)
+
+    def remove(self, record):
+        entry = (record['id'],)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(entry)
+            if self.loaded:
+                self._remove(entry[0])
+
+    def search(self, query, limit, offset=0):
+        """Returns (ranked ids for the page, total number of hits)."""
+        terms = set(tokenize(query))
+        if not terms:
+            return [], 0
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not all(postings):
+                return [], 0
+            postings.sort(key=len)
+            hits = postings[0]
+            for ids in postings[1:]:
+                hits = [question_id for question_id in hits
+                        if _contains(ids, question_id)]
+            # nsmallest is stable, so equal lengths keep ascending id order.
+            ranked = heapq.nsmallest(
+                offset + limit, hits, key=self._lengths.__getitem__)
+        return ranked[offset:], len(hits)
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        Returns up to limit (term, number of questions) completions of
+        prefix, most used first.
+        """
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._suggestions.get(prefix)
+            if cached is not None and len(cached) >= limit:
+                return cached[:limit]
+            start = bisect.bisect_left(self._terms, prefix)
+            end = bisect.bisect_left(self._terms, prefix + '\uffff', start)
+            ranked = [(term, len(self._postings[term])) for term in
+                      heapq.nsmallest(
+                          max(limit, MAX_SUGGESTIONS),
+                          self._terms[start:end],
+                          key=lambda term: (-len(self._postings[term]),
+                                            term))]
+            if end - start > SUGGEST_SCAN_LIMIT:
+                self._suggestions[prefix] = ranked
+        return ranked[:limit]
+
+    def on_change(self, action, model, records):
+        if model != 'question':
+            return
+        for record in records:
+            if action == 'delete':
+                self.remove(record)
+            else:
+                self.add(record)
+
+    def _changed(self, term, count, grew):
+        if not self._suggestions:
+            return
+        entry = (term, count)
+
+        def key(entry):
+            return -entry[1], entry[0]
+        for end in range(1, len(term) + 1):
+            ranked = self._suggestions.get(term[:end])
+            if ranked is None:
+                continue
+            others = [other for other in ranked if other[0] != term]
+            if not grew:
+                if len(others) < len(ranked):
+                    del self._suggestions[term[:end]]
+            elif len(others) < len(ranked) or key(entry) < key(ranked[-1]):
+                others.append(entry)
+                others.sort(key=key)
+                self._suggestions[term[:end]] = others[:len(ranked)]
+
+    def _add(self, question_id, terms):
+        self._lengths[question_id] = max(len(terms), 1)
+        terms = self._documents[question_id] = tuple(set(terms))
+        for term in terms:
+            ids = self._postings.get(term)
+            self._changed(term, len(ids) + 1 if ids else 1, True)
+            if ids is None:
+                self._postings[term] = array.array('i', [question_id])
+                if self._terms is not None:
+                    bisect.insort(self._terms, term)
+            elif ids[-1] < question_id:
+                ids.append(question_id)
+            else:
+                ids.insert(bisect.bisect_left(ids, question_id), question_id)
+
+    def _remove(self, question_id):
+        self._lengths.pop(question_id, None)
+        for term in self._documents.pop(question_id, ()):
+            ids = self._postings.get(term)
+            if ids is None:
+                continue
+            position = bisect.bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+                self._changed(term, len(ids), False)
+            if not ids:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+
+def _contains(ids, question_id):
+    position = bisect.bisect_left(ids, question_id)
+    return position < len(ids) and ids[position] == question_id
+
+
+class PostgresSearch(object):
+    """
+    Full-text search on Postgres using the GIN index of migration 007,
+    built over the same tsvector expression the query filters on. Postgres
+    maintains the index itself, so writes need no extra work here.
+    """
+
+    def search(self, query, limit, offset=0):
+        rows = db.session.execute(text(
+            'SELECT id, count(*) OVER () AS total '
+            'FROM questions, plainto_tsquery(\'%s\', :query) query '
+            'WHERE %s @@ query '
+            'ORDER BY ts_rank(%s, query) DESC, id '
+            'LIMIT :limit OFFSET :offset' % (
+                PG_CONFIG, PG_DOCUMENT, PG_DOCUMENT)),
+            {'query': query, 'limit': limit, 'offset': offset}).fetchall()
+        if not rows:
+            return [], 0
+        return [row[0] for row in rows], rows[0][1]
+
+
+"""
+init_app(app)
+    selects the search backend from SEARCH_BACKEND: 'auto' (default) uses
+    Postgres full-text search when the app runs on Postgres and the
+    in-process index otherwise; 'memory' and 'postgres' force one of them
+"""
+
+
+def init_app(app):
+    index = InvertedIndex()
+    app.extensions['trivia.search'] = {
+        'memory': index,
+        'postgres': PostgresSearch(),
+    }
+    app.extensions['trivia.search.resync'] = Resync(app)
+    add_listener(app, index.on_change)
+
+
+def get_index():
+    """
+    Returns the in-process index, loading it on first use and reloading it
+    after other workers' writes.
+    """
+    index = current_app.extensions['trivia.search']['memory']
+    current_app.extensions['trivia.search.resync'].sync(
+        lambda: index.load(db.session.query(
+            Question.id, Question.question, Question.answer)))
+    return index
+
+
+def get_backend():
+    backends = current_app.extensions['trivia.search']
+    name = current_app.config.get('SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = 'postgres' if db.engine.dialect.name == 'postgresql' \
+            else 'memory'
+    if name == 'memory':
+        return get_index()
+    return backends[name]
+
+
+def search_questions(query, page=1, per_page=10,
+                     fields=QUESTION_FIELDS):
+    """
+    Returns (rows of fields for the questions on the page in rank order,
+    total hits).
+    """
+    question_ids, total = get_backend().search(
+        query, per_page, (page - 1) * per_page)
+    if not question_ids:
+        return [], total
+    questions = {row.id: row for row in select(fields).filter(
+        Question.id.in_(question_ids))}
+    return [questions[question_id] for question_id in question_ids
+            if question_id in questions], total
+
+
+def suggest(text, limit=10):
+    """
+    Completes the last word of text from the in-process index. Returns up
+    to limit phrases (the earlier words followed by a completion), most
+    used completion first.
+    """
+    words = tokenize(text)
+    if not words or not TOKEN_RE.match(text[-1:]):
+        return []
+    head = ' '.join(words[:-1])
+    return [(head + ' ' + term).lstrip() for term, _ in
+            get_index().suggest(words[-1], min(limit, MAX_SUGGESTIONS))]
@@ -0,0 +1,73 @@
+import click
+from flask import request
+from sqlalchemy import func, text
+
+from models import db, CategoryStat
+
+
+def counts():
+    """
+    Returns {category: {'questions': n, 'difficulties': {difficulty: n}}}
+    from category_stats, one row per (category, difficulty) in use.
+    """
+    result = {}
+    for category, difficulty, questions in db.session.query(
+            CategoryStat.category, CategoryStat.difficulty,
+            CategoryStat.questions).filter(CategoryStat.questions > 0):
+        entry = result.setdefault(
+            category, {'questions': 0, 'difficulties': {}})
+        entry['questions'] += questions
+        entry['difficulties'][difficulty] = questions
+    return result
+
+
+def total(category=None):
+    """Number of questions, in category if given, read from the stats."""
+    query = db.session.query(
+        func.coalesce(func.sum(CategoryStat.questions), 0))
+    if category is not None:
+        query = query.filter(CategoryStat.category == category)
+    return query.scalar()
+
+
+def count(category=None, default='exact'):
+    """
+    The total for a listing's ?count= argument: None for count=none,
+    otherwise the exact number of questions read from category_stats,
+    whatever the size of the table.
+    """
+    if request.args.get('count', default) == 'none':
+        return None
+    return total(category)
+
+
+def repair():
+    """
+    Recomputes category_stats from the questions table in one transaction
+    and returns the number of rows written. On Postgres the table is locked
+    against writers first, so in-flight writes are either counted by the
+    rebuild or applied on top of it, never both.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            'LOCK TABLE category_stats IN SHARE ROW EXCLUSIVE MODE'))
+    db.session.execute(text('DELETE FROM category_stats'))
+    written = db.session.execute(text(
+        'INSERT INTO category_stats (category, difficulty, questions) '
+        'SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) '
+        'FROM questions GROUP BY 1, 2')).rowcount
+    db.session.commit()
+    return written
+
+
+"""
+init_app(app)
+    registers the repair-stats command
+"""
+
+
+def init_app(app):
+    @app.cli.command('repair-stats')
+    def repair_stats_command():
+        """Rebuild category_stats from the questions table."""
+        click.echo('%d category/difficulty rows' % repair())
@@ -0,0 +1,207 @@
+import calendar
+import collections
+import contextlib
+import fcntl
+import functools
+import os
+import threading
+import time
+import uuid
+
+from flask import request, make_response
+from werkzeug.http import http_date
+
+from models import add_listener
+
+# How many of its own bumps a process remembers to tell them apart from
+# other workers' writes; beyond that a change counts as foreign.
+OWN_VERSIONS = 1024
+RESYNC_INTERVAL = 5.0
+
+
+class DataVersion(object):
+    """
+    Monotonic version of the question and category data.
+
+    Every committed write bumps it. With a path it lives in a small file
+    shared by every worker on the host, read with a single pread under a
+    shared lock. Without one the counter lives in this process, which is
+    only correct for a single worker; a random nonce prefix keeps restarts
+    from handing out the same ETag for different data.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.nonce = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.last_modified = time.time()
+        self._own = collections.deque(maxlen=OWN_VERSIONS)
+        self._fd = None
+        if path:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked(fcntl.LOCK_EX):
+                if not os.pread(self._fd, 128, 0):
+                    self._write(self.nonce, 0, self.last_modified)
+
+    def current(self):
+        """Returns (nonce, version, last modified timestamp)."""
+        if self._fd is None:
+            return self.nonce, self.version, self.last_modified
+        with self._lock, self._locked(fcntl.LOCK_SH):
+            return self._read()
+
+    def bump(self):
+        with self._lock:
+            if self._fd is None:
+                self.version += 1
+                self.last_modified = self._next_timestamp(self.last_modified)
+                self._own.append(self.version)
+                return
+            with self._locked(fcntl.LOCK_EX):
+                nonce, version, last_modified = self._read()
+                self._write(nonce, version + 1,
+                            self._next_timestamp(last_modified))
+            self._own.append(version + 1)
+
+    def stamp(self):
+        """Returns (nonce, version), for changed_elsewhere() to compare."""
+        return self.current()[:2]
+
+    def changed_elsewhere(self, stamp):
+        """
+        True if another process bumped the version since stamp: more
+        versions were handed out than this process produced itself.
+        """
+        nonce, version = self.stamp()
+        if nonce != stamp[0]:
+            return True
+        with self._lock:
+            own = sum(1 for bumped in self._own
+                      if stamp[1] < bumped <= version)
+        return version - stamp[1] > own
+
+    def on_change(self, action, model, records):
+        self.bump()
+
+    def _next_timestamp(self, previous):
+        # Last-Modified has one second resolution, so every bump moves it
+        # to a later second; otherwise If-Modified-Since could match data
+        # written in the same second as the client's copy.
+        return max(time.time(), int(previous) + 1)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read(self):
+        nonce, version, last_modified = \
+            os.pread(self._fd, 128, 0).decode().split()
+        return nonce, int(version), float(last_modified)
+
+    def _write(self, nonce, version, last_modified):
+        data = ('%s %d %f\n' % (nonce, version, last_modified)).encode()
+        os.pwrite(self._fd, data.ljust(64), 0)
+
+
+class Resync(object):
+    """
+    Keeps an in-process copy of the data, such as an index loaded from the
+    database, in step with the writes of other workers. This process's own
+    writes reach the copy through the write listeners; for the others, the
+    copy is stamped with the data version read before its rows, and at most
+    every INDEX_RESYNC_INTERVAL seconds (default 5) the stamp is compared
+    with the shared version. The copy is reloaded once another worker has
+    bumped it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get(
+            'INDEX_RESYNC_INTERVAL', RESYNC_INTERVAL)
+        self.stamp = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def sync(self, load):
+        """Calls load() if the copy was never loaded or is out of date."""
+        data_version = self.app.extensions['trivia.data_version']
+        if self.stamp is None:
+            self._lock.acquire()
+        else:
+            now = time.time()
+            if now - self._checked < self.interval:
+                return
+            self._checked = now
+            # While one thread reloads, the others keep the current copy.
+            if not data_version.changed_elsewhere(self.stamp) or \
+                    not self._lock.acquire(False):
+                return
+        try:
+            if self.stamp is None or \
+                    data_version.changed_elsewhere(self.stamp):
+                stamp = data_version.stamp()
+                load()
+                self.stamp = stamp
+        finally:
+            self._lock.release()
+
+
+"""
+init_app(app)
+    attaches the DataVersion and returns the conditional decorator bound to
+    it. The version is shared through DATA_VERSION_FILE, by default
+    data-version in the app's instance folder, so every worker on the host
+    tags responses alike; set it to None to keep the version per process,
+    for a single worker only.
+"""
+
+
+def init_app(app):
+    path = app.config.get('DATA_VERSION_FILE', default_path(app))
+    data_version = DataVersion(path)
+    app.extensions['trivia.data_version'] = data_version
+    add_listener(app, data_version.on_change)
+
+    def conditional(view):
+        """
+        Answers a GET with 304 Not Modified when the client's ETag or
+        Last-Modified still matches the data version, before the view (and
+        any SQL) runs; otherwise tags the fresh response.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Read before the view so the tag is never newer than the body.
+            nonce, version, last_modified = data_version.current()
+            etag = '%s-%d' % (nonce, version)
+            last_modified = int(last_modified)
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                fresh = since is not None and \
+                    calendar.timegm(since.utctimetuple()) >= last_modified
+            if fresh:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Last-Modified'] = http_date(last_modified)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+
+    return conditional
+
+
+def default_path(app):
+    os.makedirs(app.instance_path, exist_ok=True)
+    return os.path.join(app.instance_path, 'data-version')
@@ -0,0 +1,305 @@
+import fcntl
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import current_app, request
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import db, notify, Category
+from flaskr import bulk
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_INTERVAL = 0.05
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_READ_TIMEOUT = 2.0
+TOKEN_HEADER = 'X-Write-Token'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteQueue(object):
+    """
+    Durable local log of accepted question submissions.
+
+    Rows are appended to a SQLite file in WAL mode with synchronous=FULL, so
+    an acknowledged submission survives a crash of the process or the host.
+    Sequence numbers only grow; the file also holds a random queue id that
+    names this log in the write_behind_marks table of the main database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'payload TEXT NOT NULL, created REAL NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS failed ('
+                'seq INTEGER PRIMARY KEY, payload TEXT NOT NULL, '
+                'error TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            conn.execute(
+                'INSERT OR IGNORE INTO meta VALUES (\'queue\', ?)',
+                (uuid.uuid4().hex,))
+            self.queue_id = conn.execute(
+                'SELECT value FROM meta WHERE key = \'queue\'').fetchone()[0]
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, row, max_pending):
+        """Stores row and returns its sequence number."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            pending, = conn.execute('SELECT count(*) FROM pending').fetchone()
+            if pending >= max_pending:
+                raise QueueFull(pending)
+            return conn.execute(
+                'INSERT INTO pending (payload, created) VALUES (?, ?)',
+                (json.dumps(row), time.time())).lastrowid
+
+    def read(self, after, limit):
+        """Returns up to limit [(seq, row)] with seq > after, in order."""
+        return [(seq, json.loads(payload)) for seq, payload in
+                self._connect().execute(
+                    'SELECT seq, payload FROM pending WHERE seq > ? '
+                    'ORDER BY seq LIMIT ?', (after, limit))]
+
+    def discard(self, upto):
+        """Drops the rows up to upto once the database has them."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM pending WHERE seq <= ?', (upto,))
+
+    def fail(self, seq, row, error):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO failed VALUES (?, ?, ?)',
+                         (seq, json.dumps(row), error))
+
+    def size(self):
+        return self._connect().execute(
+            'SELECT count(*) FROM pending').fetchone()[0]
+
+
+class WriteBehind(object):
+    """
+    Applies a WriteQueue to the database in group commits.
+
+    A background thread wakes on every submission, waits one interval so
+    concurrent submissions gather, and writes up to batch_size rows per
+    transaction through bulk.write_batch (COPY on Postgres). The queue's
+    high-water mark is upserted in that same transaction, so a batch is
+    either applied together with its mark or not at all: after a crash,
+    rows at or below the mark are discarded and the rest are replayed
+    exactly once. A lock file elects one flusher among the workers that
+    share the queue.
+    """
+
+    def __init__(self, app, queue, batch_size=DEFAULT_BATCH_SIZE,
+                 interval=DEFAULT_INTERVAL):
+        self.app = app
+        self.queue = queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.applied = None
+        self._wake = threading.Event()
+        self._flushed = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the flusher thread after one last flush."""
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+
+    def submit(self, row, max_pending):
+        seq = self.queue.append(row, max_pending)
+        self._wake.set()
+        return seq
+
+    def token(self, seq):
+        return '%s:%d' % (self.queue.queue_id, seq)
+
+    def mark(self):
+        """Highest applied sequence number, as recorded in the database."""
+        return db.session.execute(text(
+            'SELECT seq FROM write_behind_marks WHERE queue = :queue'),
+            {'queue': self.queue.queue_id}).scalar() or 0
+
+    def wait_for(self, seq, timeout):
+        """
+        Blocks until seq has been applied, flushing from this process if
+        no other worker holds the flusher lock. Returns False on timeout.
+        """
+        deadline = time.time() + timeout
+        while True:
+            if self.applied is not None and self.applied >= seq:
+                return True
+            # A flush in this process commits the mark before it notifies
+            # the write listeners; wait for those so no stale cache entry
+            # answers the read.
+            if self.mark() >= seq and not self._flush_lock.locked():
+                return True
+            db.session.rollback()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._wake.set()
+            with self._flushed:
+                self._flushed.wait(min(remaining, self.interval))
+
+    def flush(self):
+        """
+        Applies everything pending if this process can take the flusher
+        lock; returns the number of rows written.
+        """
+        with self._flush_lock, open(self.queue.path + '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            written = 0
+            with self.app.app_context():
+                try:
+                    applied = self.mark()
+                    db.session.rollback()
+                    self.queue.discard(applied)
+                    while True:
+                        entries = self.queue.read(applied, self.batch_size)
+                        if not entries:
+                            break
+                        written += self._apply(entries)
+                        applied = entries[-1][0]
+                        self.applied = applied
+                        self.queue.discard(applied)
+                finally:
+                    db.session.remove()
+            with self._flushed:
+                self._flushed.notify_all()
+            return written
+
+    def _apply(self, entries):
+        # COPY runs on the raw DBAPI cursor, so a rejected row raises the
+        # driver's own exceptions rather than SQLAlchemy's wrappers.
+        dbapi = db.engine.dialect.dbapi
+        row_errors = (DataError, IntegrityError,
+                      dbapi.DataError, dbapi.IntegrityError)
+        try:
+            records = bulk.write_batch([row for _, row in entries])
+            self._set_mark(entries[-1][0])
+            db.session.commit()
+        except row_errors:
+            db.session.rollback()
+            # One bad row must not hold back the rest: retry row by row and
+            # park the rows the database rejects. Any other error (e.g. the
+            # database being down) leaves the queue as it is for next time.
+            records = []
+            for seq, row in entries:
+                try:
+                    records.extend(bulk.write_batch([row]))
+                    self._set_mark(seq)
+                    db.session.commit()
+                except row_errors as e:
+                    db.session.rollback()
+                    self.queue.fail(seq, row, str(e).splitlines()[0])
+                    self._set_mark(seq)
+                    db.session.commit()
+        if records:
+            notify('insert', 'question', records)
+        return len(records)
+
+    def _set_mark(self, seq):
+        db.session.execute(text(
+            'INSERT INTO write_behind_marks (queue, seq) '
+            'VALUES (:queue, :seq) '
+            'ON CONFLICT (queue) DO UPDATE SET seq = excluded.seq'),
+            {'queue': self.queue.queue_id, 'seq': seq})
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(1.0)
+            self._wake.clear()
+            # Lets concurrent submissions gather into one commit.
+            self._stopped.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+
+
+"""
+init_app(app)
+    enables write-behind question creation when WRITE_BEHIND_QUEUE names a
+    local SQLite file. WRITE_BEHIND_BATCH_SIZE and WRITE_BEHIND_INTERVAL
+    (seconds) bound a group commit, WRITE_BEHIND_MAX_PENDING is the
+    backlog at which submissions get a 503, and WRITE_BEHIND_READ_TIMEOUT
+    bounds how long a read carrying an X-Write-Token waits for its write.
+"""
+
+
+def init_app(app):
+    path = app.config.get('WRITE_BEHIND_QUEUE')
+    app.extensions['trivia.write_behind'] = None
+    if not path:
+        return
+    writer = WriteBehind(
+        app, WriteQueue(path),
+        app.config.get('WRITE_BEHIND_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        app.config.get('WRITE_BEHIND_INTERVAL', DEFAULT_INTERVAL))
+    app.extensions['trivia.write_behind'] = writer
+    timeout = app.config.get('WRITE_BEHIND_READ_TIMEOUT',
+                             DEFAULT_READ_TIMEOUT)
+
+    @app.before_request
+    def read_your_writes():
+        token = request.headers.get(TOKEN_HEADER)
+        if not token or request.method != 'GET':
+            return
+        queue_id, _, seq = token.partition(':')
+        if queue_id == writer.queue.queue_id and seq.isdigit():
+            writer.wait_for(int(seq), timeout)
+
+    writer.start()
+
+
+def enabled():
+    return current_app.extensions.get('trivia.write_behind') is not None
+
+
+def submit(data):
+    """
+    Validates a submission and queues it. Returns (token, None) once it is
+    durable, or (None, error) if it is invalid; raises QueueFull when the
+    backlog is over WRITE_BEHIND_MAX_PENDING.
+    """
+    writer = current_app.extensions['trivia.write_behind']
+    category_ids = set(
+        category_id for category_id, in db.session.query(Category.id))
+    row, error = bulk.validate(data, category_ids)
+    if error is not None:
+        return None, error
+    seq = writer.submit(row, current_app.config.get(
+        'WRITE_BEHIND_MAX_PENDING', DEFAULT_MAX_PENDING))
+    return writer.token(seq), None
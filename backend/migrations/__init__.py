@@ -0,0 +1,95 @@
+"""
+Versioned schema migrations.
+
+Each vNNN_<name>.py module in this package defines DESCRIPTION and
+upgrade(connection), and is applied at most once, in version order, inside
+its own transaction together with its schema_version row. Nothing runs at
+application startup; apply them with `flask db-upgrade` or upgrade(engine).
+"""
+import datetime
+import importlib
+import pkgutil
+
+import click
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, \
+    select
+
+# Arbitrary key for pg_advisory_xact_lock, so that two concurrent upgrades
+# apply each migration once.
+LOCK_KEY = 7283461
+
+metadata = MetaData()
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime))
+
+
+def load():
+    """Returns [(version, module)] for every migration, in order."""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        if info.name.startswith('v') and info.name[1:4].isdigit():
+            module = importlib.import_module('%s.%s' % (__name__, info.name))
+            migrations.append((int(info.name[1:4]), module))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+def applied(connection):
+    schema_version.create(connection, checkfirst=True)
+    return set(version for version, in connection.execute(
+        select([schema_version.c.version])))
+
+
+def current_version(engine):
+    with engine.begin() as connection:
+        return max(applied(connection) or [0])
+
+
+def upgrade(engine, target=None):
+    """Applies pending migrations up to target; returns their versions."""
+    done = []
+    for version, module in load():
+        if target is not None and version > target:
+            break
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(
+                    'SELECT pg_advisory_xact_lock(%d)' % LOCK_KEY)
+            if version in applied(connection):
+                continue
+            module.upgrade(connection)
+            connection.execute(schema_version.insert().values(
+                version=version, description=module.DESCRIPTION,
+                applied_at=datetime.datetime.utcnow()))
+        done.append(version)
+    return done
+
+
+"""
+init_app(app)
+    registers the db-upgrade and db-version commands; they run against the
+    database set up by models.setup_db
+"""
+
+
+def init_app(app):
+    from models import db
+
+    @app.cli.command('db-upgrade')
+    @click.option('--target', type=int, help='Stop after this version.')
+    def upgrade_command(target):
+        """Apply pending schema migrations."""
+        for version in upgrade(db.engine, target):
+            click.echo('applied %03d' % version)
+        click.echo('schema at version %d' % current_version(db.engine))
+
+    @app.cli.command('db-version')
+    def version_command():
+        """Show the applied schema version and any pending migrations."""
+        current = current_version(db.engine)
+        click.echo('schema at version %d' % current)
+        for version, module in load():
+            if version > current:
+                click.echo('pending %03d %s' % (version, module.DESCRIPTION))
@@ -0,0 +1,23 @@
+"""
+Creates the categories and questions tables as trivia.psql defines them.
+Databases loaded from trivia.psql already have both and are left as is.
+"""
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, Table, Text
+
+DESCRIPTION = 'categories and questions tables'
+
+
+def upgrade(connection):
+    metadata = MetaData()
+    Table('categories', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('type', Text))
+    Table('questions', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('question', Text),
+          Column('answer', Text),
+          Column('difficulty', Integer),
+          Column('category', Integer, ForeignKey(
+              'categories.id', name='category',
+              onupdate='CASCADE', ondelete='SET NULL')))
+    metadata.create_all(connection, checkfirst=True)
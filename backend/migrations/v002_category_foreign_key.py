@@ -0,0 +1,48 @@
+"""
+Makes questions.category an integer foreign key to categories.id.
+
+Databases created by the old db.create_all() at startup have it as a
+varchar with no constraint, so every category filter compared text with
+an integer parameter. Values that are not integer ids make this fail and
+roll back rather than being dropped.
+"""
+from sqlalchemy import Integer, inspect
+
+DESCRIPTION = 'integer questions.category referencing categories.id'
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    column = next(column for column in inspector.get_columns('questions')
+                  if column['name'] == 'category')
+    has_key = any(key['constrained_columns'] == ['category']
+                  for key in inspector.get_foreign_keys('questions'))
+    if isinstance(column['type'], Integer) and has_key:
+        return
+
+    if connection.dialect.name == 'sqlite':
+        # SQLite can neither change a column type nor add a constraint.
+        connection.execute(
+            'CREATE TABLE questions_new ('
+            'id INTEGER NOT NULL PRIMARY KEY, question TEXT, answer TEXT, '
+            'difficulty INTEGER, category INTEGER, '
+            'CONSTRAINT category FOREIGN KEY (category) '
+            'REFERENCES categories (id) '
+            'ON UPDATE CASCADE ON DELETE SET NULL)')
+        connection.execute(
+            'INSERT INTO questions_new '
+            'SELECT id, question, answer, difficulty, '
+            'CAST(category AS INTEGER) FROM questions')
+        connection.execute('DROP TABLE questions')
+        connection.execute('ALTER TABLE questions_new RENAME TO questions')
+        return
+
+    if not isinstance(column['type'], Integer):
+        connection.execute(
+            'ALTER TABLE questions ALTER COLUMN category TYPE integer '
+            'USING category::integer')
+    if not has_key:
+        connection.execute(
+            'ALTER TABLE questions ADD CONSTRAINT category '
+            'FOREIGN KEY (category) REFERENCES categories (id) '
+            'ON UPDATE CASCADE ON DELETE SET NULL')
@@ -0,0 +1,26 @@
+"""
+Indexes for the hot read paths:
+    questions (category, id)  category listings in id order, with their
+                              cursors and counts, and the foreign key
+    questions (difficulty)    difficulty filters of the batch endpoints
+    questions search (GIN)    Postgres full-text search; rebuilt with
+                              the 'simple' configuration by migration 007
+"""
+
+DESCRIPTION = 'indexes on questions (category, id), difficulty and search'
+
+SEARCH_DOCUMENT = ("to_tsvector('english', coalesce(question, '') || ' ' || "
+                   "coalesce(answer, ''))")
+
+
+def upgrade(connection):
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS questions_category_id_idx '
+        'ON questions (category, id)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS questions_difficulty_idx '
+        'ON questions (difficulty)')
+    if connection.dialect.name == 'postgresql':
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS questions_search_idx '
+            'ON questions USING GIN (%s)' % SEARCH_DOCUMENT)
@@ -0,0 +1,23 @@
+"""
+Adds category_stats, the number of questions per (category, difficulty),
+and fills it from the questions table. A NULL category or difficulty is
+counted under 0. The application keeps it current on every write.
+"""
+from sqlalchemy import Column, Integer, MetaData, Table
+
+DESCRIPTION = 'category_stats table'
+
+
+def upgrade(connection):
+    metadata = MetaData()
+    Table('category_stats', metadata,
+          Column('category', Integer, primary_key=True,
+                 autoincrement=False),
+          Column('difficulty', Integer, primary_key=True,
+                 autoincrement=False),
+          Column('questions', Integer, nullable=False))
+    metadata.create_all(connection)
+    connection.execute(
+        'INSERT INTO category_stats (category, difficulty, questions) '
+        'SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) '
+        'FROM questions GROUP BY 1, 2')
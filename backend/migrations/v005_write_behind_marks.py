@@ -0,0 +1,17 @@
+"""
+Adds write_behind_marks, the highest sequence number of each write-behind
+queue that has been applied. It is updated in the same transaction as the
+questions it covers, which makes replaying a queue after a crash
+idempotent.
+"""
+from sqlalchemy import BigInteger, Column, MetaData, String, Table
+
+DESCRIPTION = 'write_behind_marks table'
+
+
+def upgrade(connection):
+    metadata = MetaData()
+    Table('write_behind_marks', metadata,
+          Column('queue', String(32), primary_key=True),
+          Column('seq', BigInteger, nullable=False))
+    metadata.create_all(connection)
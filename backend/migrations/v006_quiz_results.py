@@ -0,0 +1,32 @@
+"""
+Adds quiz_results, one row per completed game, and leaderboard, the best
+game of each player per category (0 for quizzes over all categories).
+The application appends results in batches and upserts the leaderboard
+rows they improve in the same transaction.
+"""
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, \
+    String, Table
+
+DESCRIPTION = 'quiz_results and leaderboard tables'
+
+
+def upgrade(connection):
+    metadata = MetaData()
+    Table('quiz_results', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('player', String(64), nullable=False),
+          Column('category', Integer, nullable=False),
+          Column('score', Integer, nullable=False),
+          Column('questions', Integer, nullable=False),
+          Column('duration', Float, nullable=False),
+          Column('created_at', DateTime, nullable=False),
+          Index('quiz_results_player_idx', 'player'))
+    Table('leaderboard', metadata,
+          Column('category', Integer, primary_key=True,
+                 autoincrement=False),
+          Column('player', String(64), primary_key=True),
+          Column('score', Integer, nullable=False),
+          Column('duration', Float, nullable=False),
+          Column('updated_at', Float, nullable=False),
+          Index('leaderboard_updated_at_idx', 'updated_at'))
+    metadata.create_all(connection)
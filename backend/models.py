@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from collections import Counter
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, \
+    create_engine, inspect, text
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 import json
 from settings import DB_NAME, DB_USER, DB_PASSWORD, DB_URI
@@ -12,7 +15,8 @@ db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. The schema is not
+    created here; apply the migrations with `flask db-upgrade`.
 """
 
 
@@ -21,8 +25,57 @@ def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+
+
+"""
+add_listener(app, listener)
+    registers listener(action, model, records) to be called after a write
+    to the questions or categories table has been committed. records is a
+    list of formatted rows; action is 'insert', 'update' or 'delete'.
+"""
+
+
+def add_listener(app, listener):
+    app.extensions.setdefault('trivia.listeners', []).append(listener)
+
+
+def notify(action, model, records):
+    if not has_app_context():
+        return
+    for listener in current_app.extensions.get('trivia.listeners', []):
+        listener(action, model, records)
+
+
+"""
+adjust_stats(deltas)
+    applies {(category, difficulty): change in question count} to
+    category_stats in the current transaction, so the counts commit or roll
+    back together with the write that changed them. Keys come from
+    stat_key; a NULL category or difficulty is counted under 0.
+"""
+
+
+def stat_key(category, difficulty):
+    def key(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+    return key(category), key(difficulty)
+
+
+def adjust_stats(deltas):
+    # Sorted, so concurrent writers lock the rows in the same order.
+    rows = [{'category': category, 'difficulty': difficulty, 'delta': delta}
+            for (category, difficulty), delta in sorted(deltas.items())
+            if delta]
+    if rows:
+        db.session.execute(text(
+            'INSERT INTO category_stats (category, difficulty, questions) '
+            'VALUES (:category, :difficulty, :delta) '
+            'ON CONFLICT (category, difficulty) DO UPDATE '
+            'SET questions = category_stats.questions + excluded.questions'),
+            rows)
 
 
 """
@@ -37,7 +90,7 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -48,14 +101,31 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        adjust_stats({stat_key(self.category, self.difficulty): 1})
         db.session.commit()
+        notify('insert', 'question', [self.format()])
 
     def update(self):
+        attrs = inspect(self).attrs
+        history = attrs.category.history
+        deltas = Counter()
+        deltas[stat_key(*[
+            attr.history.deleted[0] if attr.history.deleted else attr.value
+            for attr in (attrs.category, attrs.difficulty)])] -= 1
+        deltas[stat_key(self.category, self.difficulty)] += 1
+        adjust_stats(deltas)
         db.session.commit()
+        record = self.format()
+        record['previous_category'] = history.deleted[0] \
+            if history.deleted else self.category
+        notify('update', 'question', [record])
 
     def delete(self):
+        record = self.format()
         db.session.delete(self)
+        adjust_stats({stat_key(self.category, self.difficulty): -1})
         db.session.commit()
+        notify('delete', 'question', [record])
 
     def format(self):
         return {
@@ -82,8 +152,86 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify('insert', 'category', [self.format()])
+
+    def update(self):
+        db.session.commit()
+        notify('update', 'category', [self.format()])
+
+    def delete(self):
+        record = self.format()
+        # The foreign key sets the category of its questions to NULL;
+        # do it explicitly so the counts move with them on every database.
+        Question.query.filter(Question.category == self.id) \
+            .update({'category': None}, synchronize_session=False)
+        deltas = Counter()
+        for stat in CategoryStat.query.filter(
+                CategoryStat.category == self.id):
+            deltas[stat_key(None, stat.difficulty)] += stat.questions
+            deltas[stat_key(self.id, stat.difficulty)] -= stat.questions
+        adjust_stats(deltas)
+        db.session.delete(self)
+        db.session.commit()
+        notify('delete', 'category', [record])
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+CategoryStat
+    number of questions per (category, difficulty), maintained by
+    adjust_stats on every write and rebuilt by `flask repair-stats`
+
+"""
+
+
+class CategoryStat(db.Model):
+    __tablename__ = 'category_stats'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    questions = Column(Integer, nullable=False, default=0)
+
+
+"""
+QuizResult
+    one completed game, appended in batches by flaskr.leaderboard
+
+"""
+
+
+class QuizResult(db.Model):
+    __tablename__ = 'quiz_results'
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String(64), nullable=False)
+    category = Column(Integer, nullable=False)
+    score = Column(Integer, nullable=False)
+    questions = Column(Integer, nullable=False)
+    duration = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+"""
+LeaderboardEntry
+    best game of a player in a category (0 for all categories); updated_at
+    is the unix time of the write, for workers to pick up each other's
+
+"""
+
+
+class LeaderboardEntry(db.Model):
+    __tablename__ = 'leaderboard'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    player = Column(String(64), primary_key=True)
+    score = Column(Integer, nullable=False)
+    duration = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
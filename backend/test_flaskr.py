@@ -1,10 +1,17 @@
 import os
 import unittest
 import json
+import shutil
+import tempfile
+import threading
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr import create_app, batch, coalesce, dedupe, draw, \
+    leaderboard
+from models import setup_db, db, Question, Category, QuizResult, \
+    LeaderboardEntry
 from settings import DB_USER, DB_PASSWORD, DB_URI
 
 
@@ -36,6 +43,387 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(data['success'], True)
 
+    def test_get_categories_from_cache(self):
+        client = self.client()
+        first = client.get('/categories')
+        second = client.get('/categories')
+        stats = json.loads(client.get('/cache/stats').data)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_cache_invalidated_by_new_question(self):
+        client = self.client()
+        before = json.loads(client.get('/questions').data)
+        client.post('/questions', json=self.new_question)
+        after = json.loads(client.get('/questions').data)
+
+        self.assertEqual(
+            after['total_questions'], before['total_questions'] + 1)
+
+    def test_coalesce_identical_requests(self):
+        single_flight = coalesce.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        runs, bodies = [], []
+
+        def run():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            response = self.app.response_class(b'{"success": true}')
+            return response, (200, 'application/json', b'{"success": true}')
+
+        def call():
+            bodies.append(single_flight.do('/categories', run).get_data())
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=call) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        while single_flight.stats()['followers'] < 5:
+            release.wait(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(bodies, [b'{"success": true}'] * 6)
+        self.assertEqual(single_flight.stats()['in_flight'], 0)
+
+    def test_coalesce_follower_timeout(self):
+        single_flight = coalesce.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        leader = threading.Thread(target=single_flight.do, args=(
+            'key', lambda: (started.set(), release.wait(5),
+                            (None, None))[2]))
+        leader.start()
+        started.wait(5)
+        response = single_flight.do(
+            'key', lambda: ('own', (200, 'text/plain', b'')), timeout=0.01)
+        release.set()
+        leader.join()
+
+        self.assertEqual(response, 'own')
+        self.assertEqual(single_flight.stats()['timeouts'], 1)
+
+    def test_coalesce_metrics(self):
+        client = self.client()
+        client.get('/categories/1/questions?count=none')
+        body = client.get('/metrics').data.decode()
+
+        self.assertIn('trivia_coalesce_leaders_total', body)
+        self.assertIn('trivia_coalesce_followers_total', body)
+
+    def test_304_get_categories_not_modified(self):
+        client = self.client()
+        first = client.get('/categories')
+        etag = first.headers['ETag']
+        second = client.get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(first.headers['Cache-Control'], 'no-cache')
+
+    def test_etag_changes_after_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'DATA_VERSION_FILE': os.path.join(directory, 'version')}
+            reader = create_app(active=False, test_config=config)
+            writer = create_app(active=False, test_config=config)
+            setup_db(reader, self.database_path)
+            setup_db(writer, self.database_path)
+
+            etag = reader.test_client().get('/questions').headers['ETag']
+            writer.test_client().post('/questions', json=self.new_question)
+            res = reader.test_client().get(
+                '/questions', headers={'If-None-Match': etag})
+
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_memory_cache_sees_other_workers_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'DATA_VERSION_FILE': os.path.join(directory, 'version')}
+            reader = create_app(active=False, test_config=config)
+            writer = create_app(active=False, test_config=config)
+            setup_db(reader, self.database_path)
+            setup_db(writer, self.database_path)
+
+            before = reader.test_client().get('/questions').get_json()
+            writer.test_client().post('/questions', json=self.new_question)
+            after = reader.test_client().get('/questions').get_json()
+
+            self.assertEqual(after['total_questions'],
+                             before['total_questions'] + 1)
+
+    def test_data_version_shared_by_default(self):
+        reader = create_app(active=False)
+        writer = create_app(active=False)
+        before = reader.extensions['trivia.data_version'].current()
+        writer.extensions['trivia.data_version'].bump()
+        after = reader.extensions['trivia.data_version'].current()
+
+        self.assertIsNotNone(reader.extensions['trivia.data_version'].path)
+        self.assertEqual(after[1], before[1] + 1)
+
+    def test_data_version_tells_other_workers_writes(self):
+        mine = create_app(active=False).extensions['trivia.data_version']
+        other = create_app(active=False).extensions['trivia.data_version']
+        stamp = mine.stamp()
+        mine.bump()
+        self.assertFalse(mine.changed_elsewhere(stamp))
+        other.bump()
+        self.assertTrue(mine.changed_elsewhere(stamp))
+
+    def catalog_app(self, directory):
+        app = create_app(active=False, test_config={
+            'DATA_VERSION_FILE': os.path.join(directory, 'version'),
+            'CATALOG_PATH': os.path.join(directory, 'catalog'),
+            'CATALOG_REBUILD_DELAY': 3600,
+            'RESPONSE_CACHE': 'none'})
+        setup_db(app, self.database_path)
+        with app.app_context():
+            app.extensions['trivia.catalog'].rebuild()
+        return app
+
+    def test_get_questions_from_catalog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = self.catalog_app(directory).test_client()
+            from_db = self.client().get('/questions?limit=5').get_json()
+            res = client.get('/questions?limit=5')
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(
+                [q['id'] for q in data['questions']],
+                [q['id'] for q in from_db['questions']])
+            self.assertEqual(data['total_questions'],
+                             from_db['total_questions'])
+            self.assertEqual(data['categories'], from_db['categories'])
+            page = client.get(
+                '/questions?limit=5&after=' + data['next_cursor']).get_json()
+            self.assertGreater(page['questions'][0]['id'],
+                               data['questions'][-1]['id'])
+
+            res = client.get('/categories/1/questions')
+            self.assertEqual(res.status_code, 200)
+            for question in json.loads(res.data)['questions']:
+                self.assertEqual(question['category'], 1)
+
+            res = client.post('/quizzes', json={
+                'previous_questions': [], 'quiz_category': {'id': 1}})
+            self.assertEqual(json.loads(res.data)['question']['category'], 1)
+
+    def test_catalog_sparse_fieldset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = self.catalog_app(directory).test_client()
+            data = client.get(
+                '/categories/1/questions?fields=question').get_json()
+
+            self.assertTrue(data['questions'])
+            for question in data['questions']:
+                self.assertEqual(set(question), {'id', 'question'})
+
+    def test_catalog_stale_after_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = self.catalog_app(directory)
+            client = app.test_client()
+            total = client.get('/questions').get_json()['total_questions']
+            client.post('/questions', json=self.new_question)
+
+            with app.app_context():
+                self.assertIsNone(app.extensions['trivia.catalog'].current())
+            self.assertEqual(
+                client.get('/questions').get_json()['total_questions'],
+                total + 1)
+
+            with app.app_context():
+                app.extensions['trivia.catalog'].rebuild()
+                self.assertIsNotNone(
+                    app.extensions['trivia.catalog'].current())
+            self.assertEqual(
+                client.get('/questions').get_json()['total_questions'],
+                total + 1)
+
+    def test_hot_queries_use_indexes(self):
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('query plans are checked on Postgres')
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, many):
+            # Statements without WHERE or ORDER BY read a whole table by
+            # design: the category list, the stats total and the one-off
+            # loads of the draw and suggestion indexes.
+            words = ' '.join(statement.split()).upper()
+            if words.startswith('SELECT') and (
+                    ' WHERE ' in words or ' ORDER BY ' in words):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            client = self.client()
+            after = client.get('/questions?limit=2').get_json()['next_cursor']
+            client.get('/questions?limit=2&count=exact&after=' + after)
+            after = client.get(
+                '/categories/1/questions?limit=1').get_json()['next_cursor']
+            client.get('/categories/1/questions?limit=1&after=' + after)
+            client.get('/questions/category/1')
+            client.post('/questions/search', json={'searchTerm': 'title'})
+            client.post('/quizzes', json={
+                'previous_questions': [], 'quiz_category': {'id': 1}})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertTrue(statements)
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # Priced out sequential scans are only chosen when no index fits.
+            cursor.execute('SET enable_seqscan = off')
+            for statement, parameters in statements:
+                cursor.execute('EXPLAIN ' + statement, parameters)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                self.assertNotIn('Seq Scan', plan, statement)
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def test_suggest_questions(self):
+        client = self.client()
+        res = client.get('/questions/suggest?q=Which+bo&limit=3')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['suggestions'])
+        self.assertLessEqual(len(data['suggestions']), 3)
+        for suggestion in data['suggestions']:
+            self.assertTrue(suggestion.startswith('which bo'))
+
+    def test_suggestions_follow_writes(self):
+        client = self.client()
+        client.get('/questions/suggest?q=zy')
+        client.post('/questions', json=dict(
+            self.new_question, question='Zyzzyva beetle?'))
+        data = client.get('/questions/suggest?q=zyz').get_json()
+        self.assertEqual(data['suggestions'], ['zyzzyva'])
+
+        with self.app.app_context():
+            Question.query.filter(
+                Question.question == 'Zyzzyva beetle?').one().delete()
+        data = client.get('/questions/suggest?q=zyz').get_json()
+        self.assertEqual(data['suggestions'], [])
+
+    def test_suggestions_follow_other_workers(self):
+        config = {'INDEX_RESYNC_INTERVAL': 0}
+        reader = create_app(active=False, test_config=config)
+        writer = create_app(active=False, test_config=config)
+        setup_db(reader, self.database_path)
+        setup_db(writer, self.database_path)
+        client = reader.test_client()
+        client.get('/questions/suggest?q=qu')
+
+        with writer.app_context():
+            question = Question(question='Quokka habitat?', answer='Rottnest',
+                                category=1, difficulty=1)
+            question.insert()
+            question_id = question.id
+        data = client.get('/questions/suggest?q=quok').get_json()
+        self.assertEqual(data['suggestions'], ['quokka'])
+
+        with writer.app_context():
+            Question.query.get(question_id).delete()
+        data = client.get('/questions/suggest?q=quok').get_json()
+        self.assertEqual(data['suggestions'], [])
+
+    @unittest.skipIf(dedupe.np is None, 'numpy is not installed')
+    def test_create_question_flags_near_duplicate(self):
+        client = self.client()
+        res = client.post('/questions', json=dict(
+            self.new_question,
+            question="Whose autobiography is entitled 'I know why the "
+                     "caged bird sings'",
+            answer='Maya Angelou'))
+        data = json.loads(res.data)
+
+        self.assertTrue(data['success'])
+        self.assertIn(5, data['duplicates'])
+
+        res = client.post('/questions', json=dict(
+            self.new_question, question='How many moons does Neptune have?',
+            answer='Sixteen'))
+        self.assertEqual(json.loads(res.data)['duplicates'], [])
+
+    @unittest.skipIf(dedupe.np is None, 'numpy is not installed')
+    def test_duplicates_of_other_workers_questions(self):
+        config = {'INDEX_RESYNC_INTERVAL': 0}
+        reader = create_app(active=False, test_config=config)
+        writer = create_app(active=False, test_config=config)
+        setup_db(reader, self.database_path)
+        setup_db(writer, self.database_path)
+        client = reader.test_client()
+        client.post('/questions', json=self.new_question)
+
+        with writer.app_context():
+            question = Question(
+                question='Which moon of Saturn has a thick nitrogen '
+                         'atmosphere?', answer='Titan', category=1,
+                difficulty=3)
+            question.insert()
+            question_id = question.id
+        res = client.post('/questions', json=dict(
+            self.new_question,
+            question='Which moon of Saturn has a thick nitrogen atmosphere',
+            answer='Titan'))
+
+        self.assertIn(question_id, res.get_json()['duplicates'])
+
+    @unittest.skipIf(dedupe.np is None, 'numpy is not installed')
+    def test_find_duplicates_command(self):
+        with self.app.app_context():
+            copy = Question(
+                question="Whose autobiography is called 'I Know Why the "
+                         "Caged Bird Sings'?",
+                answer='Maya Angelou', category=4, difficulty=2)
+            copy.insert()
+            copy_id = copy.id
+        res = self.app.test_cli_runner(mix_stderr=False).invoke(
+            args=['find-duplicates'])
+
+        self.assertEqual(res.exit_code, 0)
+        clusters = [line.split() for line in res.output.splitlines()]
+        self.assertTrue(any(
+            '5' in members and str(copy_id) in members
+            for members in clusters))
+
+    @unittest.skipIf(dedupe.np is None, 'numpy is not installed')
+    def test_lsh_index_merge_after_delete_and_update(self):
+        rows = [(i, 'question number %d on topic %d' % (i, i * 7), '')
+                for i in range(12)]
+        _, keys = dedupe.band_keys(rows)
+        index = dedupe.LSHIndex()
+        index.load(rows[:8])
+        index.remove(2)
+        index.add(5, keys[10])
+        index._merge()
+        index.add(8, keys[8])
+        index._merge()
+
+        def probe(row, band):
+            """Keys that match row in just one band."""
+            probe = dedupe.np.zeros(dedupe.BANDS, dtype=dedupe.np.uint64)
+            probe[band] = row[band]
+            return index.candidates(probe)
+
+        for band in range(dedupe.BANDS):
+            for i in (0, 1, 3, 4, 6, 7, 8):
+                self.assertIn(i, probe(keys[i], band))
+            self.assertNotIn(2, probe(keys[2], band))
+            self.assertNotIn(5, probe(keys[5], band))
+            self.assertIn(5, probe(keys[10], band))
+
     def test_get_questions(self):
         response = self.client().get('/questions')
         data = json.loads(response.data)
@@ -59,13 +447,139 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIn('message', data)
         self.assertEqual(data['message'], "Resource not found")
 
+    def test_get_questions_sparse_fieldset(self):
+        client = self.client()
+        full = client.get('/questions?limit=5').get_json()
+        data = client.get(
+            '/questions?limit=5&fields=question,difficulty').get_json()
+
+        self.assertEqual(data['questions'], [
+            {'id': q['id'], 'question': q['question'],
+             'difficulty': q['difficulty']} for q in full['questions']])
+        page = client.get('/questions?limit=5&fields=question&after=' +
+                          data['next_cursor']).get_json()
+        self.assertGreater(page['questions'][0]['id'],
+                           data['questions'][-1]['id'])
+
+    def test_sparse_fieldset_on_category_and_search(self):
+        client = self.client()
+        data = client.get('/categories/1/questions?fields=answer').get_json()
+        self.assertEqual(set(data['questions'][0]), {'id', 'answer'})
+        data = client.get('/questions/category/1?fields=category').get_json()
+        self.assertEqual(data['questions'][0]['category'], 1)
+        self.assertNotIn('answer', data['questions'][0])
+
+        data = client.post('/questions/search?fields=question',
+                           json={'searchTerm': 'scarab'}).get_json()
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+
+    def test_422_unknown_field(self):
+        client = self.client()
+        for res in (client.get('/questions?fields=question,secret'),
+                    client.get('/categories/1/questions?fields=secret'),
+                    client.post('/questions/search?fields=secret',
+                                json={'searchTerm': 'scarab'})):
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(res.get_json()['success'])
+
+    def test_get_questions_with_cursor(self):
+        response = self.client().get('/questions?limit=4')
+        data = json.loads(response.data)
+        total = data['total_questions']
+        ids = [question['id'] for question in data['questions']]
+
+        while data['next_cursor']:
+            response = self.client().get(
+                '/questions?limit=4&after=' + data['next_cursor'])
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(data['total_questions'])
+            ids.extend(question['id'] for question in data['questions'])
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), total)
+
+    def test_422_get_questions_with_invalid_cursor(self):
+        response = self.client().get('/questions?after=not-a-cursor')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_get_category_questions_with_cursor(self):
+        response = self.client().get('/categories/3/questions?limit=2')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['currentCategory'], 'Geography')
+        self.assertEqual(len(data['questions']), 2)
+
+        response = self.client().get(
+            '/categories/3/questions?limit=2&after=' + data['next_cursor'])
+        data_next = json.loads(response.data)
+        self.assertTrue(data_next['success'])
+        self.assertGreater(
+            data_next['questions'][0]['id'], data['questions'][-1]['id'])
+
+        response = self.client().get(
+            '/categories/4/questions?after=' + data['next_cursor'])
+        self.assertEqual(response.status_code, 422)
+
+    def test_metrics(self):
+        client = self.client()
+        client.get('/questions')
+        res = client.get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_request_duration_seconds_count'
+            '{route="/questions",method="GET"} 1', body)
+        self.assertIn(
+            'trivia_sql_statements_total{route="/questions",method="GET"}',
+            body)
+        self.assertIn('trivia_response_cache_misses_total 1', body)
+
+    def test_n_plus_one_counts_requests(self):
+        app = create_app(active=False, test_config={
+            'N_PLUS_ONE_THRESHOLD': 1,
+            'RESPONSE_CACHE': 'none'})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        client.get('/questions')
+        body = client.get('/metrics').data.decode()
+
+        self.assertIn('trivia_sql_n_plus_one_total'
+                      '{route="/questions",method="GET"} 1\n', body)
+
+    def test_server_timing_header(self):
+        app = create_app(active=False, test_config={
+            'METRICS_SERVER_TIMING': True,
+            'RESPONSE_CACHE': 'none'})
+        setup_db(app, self.database_path)
+        res = app.test_client().get('/categories')
+
+        self.assertRegex(
+            res.headers['Server-Timing'],
+            r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", app;dur=[0-9.]+$')
+
     def test_delete_question(self):
         with self.app.app_context():
-            response = self.client().delete(f'/questions/12')
+            question = Question(
+                question="To be deleted?", answer="Yes",
+                category="1", difficulty=1)
+            question.insert()
+            question_id = question.id
+
+            response = self.client().delete(f'/questions/{question_id}')
             data = json.loads(response.data)
-            question = Question.query.filter(Question.id == 12).one_or_none()
+            question = Question.query.filter(
+                Question.id == question_id).one_or_none()
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(data['success'], False)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], question_id)
+        self.assertIsNone(question)
 
     def test_422_delete_question(self):
         response = self.client().delete(f'/questions/300')
@@ -73,6 +587,182 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['success'], False)
 
+    def create_questions(self, count, category="2"):
+        ids = []
+        with self.app.app_context():
+            for number in range(count):
+                question = Question(
+                    question=f"Batch question {number}?", answer="Batch",
+                    category=category, difficulty=1)
+                question.insert()
+                ids.append(question.id)
+        return ids
+
+    def category_count(self, category_id):
+        data = self.client().get('/categories').get_json()
+        return data['statistics'].get(str(category_id), {}).get(
+            'questions', 0), data['total_questions']
+
+    def test_category_statistics_follow_writes(self):
+        science, total = self.category_count(1)
+        art, _ = self.category_count(2)
+        ids = self.create_questions(3)
+        self.assertEqual(self.category_count(2), (art + 3, total + 3))
+
+        self.client().post('/questions/batch-update', json={
+            "ids": ids[:2], "set": {"category": 1}})
+        self.assertEqual(self.category_count(1)[0], science + 2)
+        self.assertEqual(self.category_count(2)[0], art + 1)
+
+        self.client().delete(f'/questions/{ids[2]}')
+        self.client().post('/questions/batch-delete', json={"ids": ids})
+        self.assertEqual(self.category_count(1), (science, total))
+        self.assertEqual(self.category_count(2), (art, total))
+
+    def test_repair_category_statistics(self):
+        before = self.client().get('/categories').get_json()['statistics']
+        with self.app.app_context():
+            db.session.execute('UPDATE category_stats SET questions = 0')
+            db.session.commit()
+        res = self.app.test_cli_runner().invoke(args=['repair-stats'])
+
+        self.assertEqual(res.exit_code, 0)
+        self.assertEqual(
+            self.client().get('/categories').get_json()['statistics'], before)
+
+    def write_behind_app(self, **config):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config['WRITE_BEHIND_QUEUE'] = os.path.join(directory, 'queue.db')
+        app = create_app(active=False, test_config=config)
+        setup_db(app, self.database_path)
+        self.addCleanup(app.extensions['trivia.write_behind'].stop)
+        return app
+
+    def test_create_question_write_behind(self):
+        client = self.write_behind_app().test_client()
+        total = client.get('/questions').get_json()['total_questions']
+        res = client.post('/questions', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(res.headers['X-Write-Token'], data['write_token'])
+        res = client.get('/questions', headers={
+            'X-Write-Token': data['write_token']})
+        self.assertEqual(res.get_json()['total_questions'], total + 1)
+
+    def test_write_behind_applies_once_after_restart(self):
+        app = self.write_behind_app(WRITE_BEHIND_INTERVAL=3600)
+        writer = app.extensions['trivia.write_behind']
+        row = dict(self.new_question, question='Write-behind replay?',
+                   category=1, difficulty=5)
+        seq = writer.queue.append(row, 10)
+        # Applied, but the process dies before dropping it from the log.
+        with app.app_context():
+            writer._apply([(seq, dict(row))])
+        writer.flush()
+
+        with app.app_context():
+            self.assertEqual(Question.query.filter(
+                Question.question == 'Write-behind replay?').count(), 1)
+        self.assertEqual(writer.queue.size(), 0)
+
+    def test_write_behind_parks_rejected_row(self):
+        app = self.write_behind_app(WRITE_BEHIND_INTERVAL=3600)
+        writer = app.extensions['trivia.write_behind']
+        row = dict(self.new_question, category=1, difficulty=5)
+        writer.queue.append(dict(row, question='Write-behind orphan?',
+                                 category=999999), 10)
+        for number in range(2):
+            writer.queue.append(
+                dict(row, question='Write-behind after %d?' % number), 10)
+        writer.flush()
+
+        self.assertEqual(writer.queue.size(), 0)
+        with app.app_context():
+            self.assertEqual(Question.query.filter(Question.question.like(
+                'Write-behind after %')).count(), 2)
+            if db.engine.dialect.name == 'postgresql':
+                self.assertEqual(writer.queue._connect().execute(
+                    'SELECT count(*) FROM failed').fetchone()[0], 1)
+            # SQLite does not enforce the foreign key and keeps the row.
+            for question in Question.query.filter(
+                    Question.question == 'Write-behind orphan?'):
+                question.delete()
+
+    def test_422_import_unknown_format(self):
+        res = self.client().post('/questions/import?format=xml',
+                                 data=json.dumps(self.new_question))
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_import_rejects_nul(self):
+        res = self.client().post('/questions/import', data=json.dumps(
+            dict(self.new_question, question='Nul\u0000?')))
+        data = json.loads(res.data)
+
+        self.assertEqual((data['inserted'], data['failed']), (0, 1))
+        self.assertIn('NUL', data['errors'][0]['error'])
+
+    def test_503_write_behind_backpressure(self):
+        client = self.write_behind_app(
+            WRITE_BEHIND_MAX_PENDING=0).test_client()
+        res = client.post('/questions', json=self.new_question)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_422_write_behind_invalid_question(self):
+        client = self.write_behind_app().test_client()
+        res = client.post('/questions', json={"question": "Hi"})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_batch_delete_questions(self):
+        ids = self.create_questions(3)
+        res = self.client().post(
+            '/questions/batch-delete', json={"ids": ids + [100000]})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], ids)
+        self.assertEqual(data['count'], 3)
+        with self.app.app_context():
+            self.assertEqual(
+                Question.query.filter(Question.id.in_(ids)).count(), 0)
+
+    def test_batch_delete_questions_in_chunks(self):
+        ids = self.create_questions(2)
+        missing = list(range(200000, 200000 + 2 * batch.CHUNK_SIZE))
+        res = self.client().post(
+            '/questions/batch-delete', json={"ids": missing + ids})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['deleted'], ids)
+        self.assertEqual(data['count'], 2)
+
+    def test_batch_update_questions(self):
+        ids = self.create_questions(2)
+        res = self.client().post('/questions/batch-update', json={
+            "ids": ids, "set": {"difficulty": 4}})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['updated'], ids)
+        with self.app.app_context():
+            difficulties = [question.difficulty for question in
+                            Question.query.filter(Question.id.in_(ids))]
+        self.assertEqual(difficulties, [4, 4])
+        self.client().post('/questions/batch-delete', json={"ids": ids})
+
+    def test_422_batch_delete_without_criteria(self):
+        res = self.client().post('/questions/batch-delete', json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_add_question(self):
         res = self.client().post('/questions', json=self.new_question)
         data = json.loads(res.data)
@@ -87,6 +777,49 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 405)
         self.assertEqual(data['success'], False)
 
+    def test_import_questions(self):
+        lines = [
+            json.dumps({"question": "Bulk question one?", "answer": "One",
+                        "category": 1, "difficulty": 2}),
+            'not json',
+            json.dumps({"question": "", "answer": "Empty",
+                        "category": 1, "difficulty": 2}),
+            json.dumps({"question": "Bulk question two?", "answer": "Two",
+                        "category": "2", "difficulty": "3"}),
+        ]
+        res = self.client().post(
+            '/questions/import',
+            data='\n'.join(lines),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_import_questions_csv(self):
+        res = self.client().post(
+            '/questions/import',
+            data='question,answer,category,difficulty\n'
+                 '"Bulk, csv question?",Yes,3,1\n'
+                 'Bad category?,No,999,1\n',
+            content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertIn(5, [row['id'] for row in rows])
+        self.assertEqual(
+            [row['id'] for row in rows], sorted(row['id'] for row in rows))
+
     def test_search_question(self):
         res = self.client().post(
             '/questions/search',
@@ -107,6 +840,52 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], False)
 
+    def test_search_question_matches_answer_text(self):
+        res = self.client().post(
+            '/questions/search',
+            json={
+                "searchTerm": "scarab"})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertIn(23, [question['id'] for question in data['questions']])
+
+    def test_search_question_is_paginated(self):
+        res = self.client().post(
+            '/questions/search',
+            json={
+                "searchTerm": "which",
+                "page": 1})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['questions']), 10)
+        self.assertGreaterEqual(data['totalQuestions'], len(data['questions']))
+
+    def test_search_index_follows_create_and_delete(self):
+        with self.app.app_context():
+            self.client().post('/questions/search', json={"searchTerm": "x"})
+            question = Question(
+                question="What is the zorblaxian capital?",
+                answer="Quuxville",
+                category="3",
+                difficulty=1)
+            question.insert()
+            question_id = question.id
+
+            res = self.client().post(
+                '/questions/search', json={"searchTerm": "zorblaxian"})
+            data = json.loads(res.data)
+            self.assertEqual(data['success'], True)
+            self.assertIn(
+                question_id, [q['id'] for q in data['questions']])
+
+            question.delete()
+            res = self.client().post(
+                '/questions/search', json={"searchTerm": "zorblaxian"})
+            data = json.loads(res.data)
+            self.assertEqual(data['success'], False)
+
     def test_quizzes(self):
         res = self.client().post(
             '/quizzes',
@@ -122,6 +901,13 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_quizzes_without_category(self):
+        res = self.client().post('/quizzes', json={
+            "previous_questions": [], "quiz_category": None})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+
     def test_fail_quiz_with_invalid_category(self):
         res = self.client().post(
             '/quizzes',
@@ -137,6 +923,254 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], False)
 
+    def test_draw_index_follows_other_workers(self):
+        config = {'INDEX_RESYNC_INTERVAL': 0}
+        reader = create_app(active=False, test_config=config)
+        writer = create_app(active=False, test_config=config)
+        setup_db(reader, self.database_path)
+        setup_db(writer, self.database_path)
+        with reader.app_context():
+            size = draw.get_index().size(1)
+
+        with writer.app_context():
+            question = Question(question='Hi', answer='Hello', category=1,
+                                difficulty=5)
+            question.insert()
+            question_id = question.id
+        with reader.app_context():
+            self.assertEqual(draw.get_index().size(1), size + 1)
+
+        with writer.app_context():
+            Question.query.get(question_id).delete()
+        with reader.app_context():
+            self.assertEqual(draw.get_index().size(1), size)
+
+    def test_quiz_skips_previous_questions(self):
+        res = self.client().post(
+            '/quizzes',
+            json={
+                "previous_questions": [
+                    20,
+                    21],
+                "quiz_category": {
+                    "type": "Science",
+                    "id": "1"}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], [20, 21])
+        self.assertEqual(str(data['question']['category']), "1")
+
+    def test_quiz_draws_newly_added_question(self):
+        question = {
+            "question": "Which country hosted the 2014 World Cup?",
+            "answer": "Brazil",
+            "category": "6",
+            "difficulty": 2}
+        self.client().post('/quizzes', json={
+            "previous_questions": [],
+            "quiz_category": {"type": "Sports", "id": "6"}})
+        self.client().post('/questions', json=question)
+
+        res = self.client().post(
+            '/quizzes',
+            json={
+                "previous_questions": [
+                    10,
+                    11],
+                "quiz_category": {
+                    "type": "Sports",
+                    "id": "6"}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], [10, 11])
+
+    def test_quiz_batch(self):
+        res = self.client().post('/quizzes/batch', json={
+            "previous_questions": [10, 11], "count": 4,
+            "quiz_category": {"type": "ALL", "id": 0}})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+        self.assertFalse(set(ids) & {10, 11})
+
+    def test_quiz_batch_stratified(self):
+        statistics = self.client().get('/categories').get_json()['statistics']
+        levels = sorted(set(int(level) for entry in statistics.values()
+                            for level in entry['difficulties']))
+        res = self.client().post('/quizzes/batch', json={
+            "count": len(levels), "difficulty": "stratified"})
+        questions = json.loads(res.data)['questions']
+
+        self.assertEqual(
+            sorted(question['difficulty'] for question in questions), levels)
+
+    def test_quiz_batch_weighted(self):
+        res = self.client().post('/quizzes/batch', json={
+            "count": 3, "difficulty": {"1": 1, "5": 0}})
+        questions = json.loads(res.data)['questions']
+
+        self.assertTrue(questions)
+        for question in questions:
+            self.assertEqual(question['difficulty'], 1)
+
+    def test_422_quiz_batch_bad_difficulty(self):
+        res = self.client().post('/quizzes/batch', json={"difficulty": "hard"})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_quiz_session_next_batch(self):
+        client = self.client()
+        data = client.post('/quizzes/sessions', json={
+            "quiz_category": {"type": "ALL", "id": 0}}).get_json()
+        res = client.post(f"/quizzes/sessions/{data['session']}/next",
+                          json={"count": 3})
+        questions = json.loads(res.data)['questions']
+        following = client.post(
+            f"/quizzes/sessions/{data['session']}/next").get_json()
+
+        self.assertEqual(len(questions), 3)
+        self.assertNotIn(following['question']['id'],
+                         [question['id'] for question in questions])
+
+    def play_quiz_session(self, client):
+        res = client.post('/quizzes/sessions', json={
+            "quiz_category": {"type": "Science", "id": "1"}})
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+
+        seen = []
+        for _ in range(data['totalQuestions']):
+            res = client.post(f"/quizzes/sessions/{data['session']}/next")
+            question = json.loads(res.data)['question']
+            if question is None:
+                break
+            self.assertEqual(str(question['category']), "1")
+            seen.append(question['id'])
+
+        self.assertTrue(seen)
+        self.assertEqual(len(seen), len(set(seen)))
+        res = client.post(f"/quizzes/sessions/{data['session']}/next")
+        self.assertIsNone(json.loads(res.data)['question'])
+
+    def test_quiz_session(self):
+        self.play_quiz_session(self.client())
+
+    def test_quiz_session_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app(active=False, test_config={
+                'QUIZ_SESSION_STORE': 'sqlite:///' + os.path.join(
+                    directory, 'sessions.db')})
+            setup_db(app, self.database_path)
+            self.play_quiz_session(app.test_client())
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+
+    def leaderboard_app(self, interval=3600):
+        app = create_app(active=False, test_config={
+            'LEADERBOARD_FLUSH_INTERVAL': interval})
+        setup_db(app, self.database_path)
+        self.addCleanup(app.extensions['trivia.leaderboards'].stop)
+        return app
+
+    def test_quiz_results_leaderboard(self):
+        client = self.leaderboard_app().test_client()
+        for player, score, duration in [('ada', 3, 40), ('bob', 5, 60),
+                                        ('cy', 5, 30), ('ada', 4, 50),
+                                        ('bob', 2, 10)]:
+            res = client.post('/quizzes/results', json={
+                'player': player, 'category': 1, 'score': score,
+                'questions': 5, 'duration': duration})
+            self.assertTrue(res.get_json()['success'])
+        self.assertEqual(res.get_json()['rank'], 2)
+        self.assertEqual(res.get_json()['best'], {'score': 5, 'duration': 60})
+
+        data = client.get('/leaderboard/1?limit=2').get_json()
+        self.assertEqual(data['players'], 3)
+        self.assertEqual(
+            [(leader['rank'], leader['player']) for leader in data['leaders']],
+            [(1, 'cy'), (2, 'bob')])
+        data = client.get('/leaderboard/1/players/ada').get_json()
+        self.assertEqual((data['rank'], data['score']), (3, 4))
+
+        res = client.get('/leaderboard/1/players/nobody')
+        self.assertEqual(res.status_code, 404)
+
+    def test_422_quiz_result_invalid(self):
+        client = self.leaderboard_app().test_client()
+        for body in [{'player': 'ada', 'score': 6, 'questions': 5,
+                      'duration': 1},
+                     {'player': '', 'score': 1, 'questions': 5,
+                      'duration': 1},
+                     {'player': 'ada', 'category': 1000, 'score': 1,
+                      'questions': 5, 'duration': 1}]:
+            res = client.post('/quizzes/results', json=body)
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(res.get_json()['success'])
+
+    def test_quiz_results_persisted_in_batches(self):
+        app = self.leaderboard_app()
+        client = app.test_client()
+        for score in (2, 4, 3):
+            client.post('/quizzes/results', json={
+                'player': 'persisted', 'category': 2, 'score': score,
+                'questions': 5, 'duration': 12.5})
+
+        self.assertEqual(app.extensions['trivia.leaderboards'].flush(), 3)
+        with app.app_context():
+            self.assertEqual(QuizResult.query.filter(
+                QuizResult.player == 'persisted').count(), 3)
+            self.assertEqual(LeaderboardEntry.query.get(
+                (2, 'persisted')).score, 4)
+
+        # Another worker starts from the persisted standings.
+        data = self.leaderboard_app().test_client().get(
+            '/leaderboard/2/players/persisted').get_json()
+        self.assertEqual((data['score'], data['duration']), (4, 12.5))
+
+    def test_leaderboard_follows_other_workers(self):
+        reader = self.leaderboard_app(interval=0.05).test_client()
+        reader.get('/leaderboard/3')
+        writer = self.leaderboard_app()
+        writer.test_client().post('/quizzes/results', json={
+            'player': 'elsewhere', 'category': 3, 'score': 4,
+            'questions': 5, 'duration': 20})
+        writer.extensions['trivia.leaderboards'].flush()
+
+        for _ in range(100):
+            res = reader.get('/leaderboard/3/players/elsewhere')
+            if res.status_code == 200:
+                break
+            time.sleep(0.05)
+        self.assertEqual(res.get_json()['score'], 4)
+
+    def test_skip_list_rank_and_slice(self):
+        skip_list = leaderboard.SkipList(seed=1)
+        keys = list(range(0, 200, 2))
+        for key in reversed(keys):
+            skip_list.insert(key)
+        skip_list.remove(10)
+        keys.remove(10)
+
+        self.assertEqual(len(skip_list), len(keys))
+        self.assertEqual(skip_list.rank(42), keys.index(42))
+        self.assertIsNone(skip_list.rank(43))
+        self.assertEqual(skip_list.slice(30, 5), keys[30:35])
+        self.assertEqual(skip_list.slice(98, 5), keys[98:])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
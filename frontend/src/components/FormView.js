@@ -47,6 +47,11 @@ class FormView extends Component {
       },
       crossDomain: true,
       success: (result) => {
+        if (result.write_token) {
+          // Queued for write-behind: the list view sends the token back so
+          // that the server waits until the question is visible.
+          sessionStorage.setItem('writeToken', result.write_token);
+        }
         document.getElementById('add-question-form').reset();
         return;
       },
@@ -4,6 +4,12 @@ import Question from './Question';
 import Search from './Search';
 import $ from 'jquery';
 
+// Read-your-writes for questions queued by FormView in write-behind mode.
+const writeTokenHeaders = () => {
+  const token = sessionStorage.getItem('writeToken');
+  return token ? { 'X-Write-Token': token } : {};
+};
+
 class QuestionView extends Component {
   constructor() {
     super();
@@ -13,6 +19,7 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      currentCategoryId: null,
     };
   }
 
@@ -24,12 +31,14 @@ class QuestionView extends Component {
     $.ajax({
       url: `/questions?page=${this.state.page}`, //TODO: update request URL
       type: 'GET',
+      headers: writeTokenHeaders(),
       success: (result) => {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
           categories: result.categories,
           currentCategory: result.current_category,
+          currentCategoryId: null,
         });
         return;
       },
@@ -41,7 +50,11 @@ class QuestionView extends Component {
   };
 
   selectPage(num) {
-    this.setState({ page: num }, () => this.getQuestions());
+    this.setState({ page: num }, () =>
+      this.state.currentCategoryId
+        ? this.getByCategory(this.state.currentCategoryId, num)
+        : this.getQuestions()
+    );
   }
 
   createPagination() {
@@ -63,15 +76,18 @@ class QuestionView extends Component {
     return pageNumbers;
   }
 
-  getByCategory = (id) => {
+  getByCategory = (id, page = 1) => {
     $.ajax({
-      url: `/categories/${id}/questions`, //TODO: update request URL
+      url: `/categories/${id}/questions?page=${page}`, //TODO: update request URL
       type: 'GET',
+      headers: writeTokenHeaders(),
       success: (result) => {
         this.setState({
           questions: result.questions,
-          totalQuestions: result.total_questions,
-          currentCategory: result.current_category,
+          page: page,
+          totalQuestions: result.totalQuestions,
+          currentCategory: result.currentCategory,
+          currentCategoryId: id,
         });
         return;
       },
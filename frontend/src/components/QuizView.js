@@ -9,13 +9,20 @@ class QuizView extends Component {
     super();
     this.state = {
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [],
+      prefetched: [],
       showAnswer: false,
       categories: {},
+      statistics: {},
+      totalQuestions: 0,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      startedAt: null,
+      player: '',
+      result: null,
     };
   }
 
@@ -24,7 +31,11 @@ class QuizView extends Component {
       url: `/categories`, //TODO: update request URL
       type: 'GET',
       success: (result) => {
-        this.setState({ categories: result.categories });
+        this.setState({
+          categories: result.categories,
+          statistics: result.statistics || {},
+          totalQuestions: result.total_questions || 0,
+        });
         return;
       },
       error: (error) => {
@@ -35,7 +46,38 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.startSession);
+  };
+
+  startSession = () => {
+    $.ajax({
+      url: `/quizzes/sessions`, //TODO: update request URL
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: this.state.quizCategory,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        if (!result.success) {
+          this.setState({ forceEnd: true });
+          return;
+        }
+        this.setState(
+          { quizSession: result.session, startedAt: Date.now() },
+          this.getNextQuestion
+        );
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again');
+        return;
+      },
+    });
   };
 
   handleChange = (event) => {
@@ -48,27 +90,29 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // The rest of the game is fetched in one round trip and played from
+    // the prefetched queue.
+    if (this.state.prefetched.length > 0) {
+      const [question, ...prefetched] = this.state.prefetched;
+      this.showQuestion(question, previousQuestions, prefetched);
+      return;
+    }
+
     $.ajax({
-      url: `/quizzes`, //TODO: update request URL
+      url: `/quizzes/sessions/${this.state.quizSession}/next`, //TODO: update request URL
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory,
+        count: Math.max(questionsPerPlay - previousQuestions.length, 1),
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
-        });
+        const [question = null, ...prefetched] = result.questions || [];
+        this.showQuestion(question, previousQuestions, prefetched);
         return;
       },
       error: (error) => {
@@ -78,6 +122,17 @@ class QuizView extends Component {
     });
   };
 
+  showQuestion = (question, previousQuestions, prefetched) => {
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      prefetched: prefetched,
+      currentQuestion: question,
+      guess: '',
+      forceEnd: question ? false : true,
+    });
+  };
+
   submitGuess = (event) => {
     event.preventDefault();
     let evaluate = this.evaluateAnswer();
@@ -90,12 +145,51 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [],
+      prefetched: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      startedAt: null,
+      result: null,
+    });
+  };
+
+  saveResult = (event) => {
+    event.preventDefault();
+    const questions = this.state.previousQuestions.length;
+    if (!this.state.player.trim() || questions === 0) {
+      return;
+    }
+    $.ajax({
+      url: `/quizzes/results`, //TODO: update request URL
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        category: this.state.quizCategory.id,
+        score: this.state.numCorrect,
+        questions: questions,
+        duration: (Date.now() - this.state.startedAt) / 1000,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        if (result.success) {
+          this.setState({ result: result });
+        }
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again');
+        return;
+      },
     });
   };
 
@@ -105,19 +199,22 @@ class QuizView extends Component {
         <div className='choose-header'>Choose Category</div>
         <div className='category-holder'>
           <div className='play-category' onClick={this.selectCategory}>
-            ALL
+            ALL ({this.state.totalQuestions})
           </div>
           {Object.keys(this.state.categories).map((id) => {
+            const stats = this.state.statistics[id];
+            const count = stats ? stats.questions : 0;
             return (
               <div
                 key={id}
                 value={id}
                 className='play-category'
                 onClick={() =>
+                  count > 0 &&
                   this.selectCategory({ type: this.state.categories[id], id })
                 }
               >
-                {this.state.categories[id]}
+                {this.state.categories[id]} ({count})
               </div>
             );
           })}
@@ -132,6 +229,22 @@ class QuizView extends Component {
         <div className='final-header'>
           Your Final Score is {this.state.numCorrect}
         </div>
+        {this.state.result ? (
+          <div className='final-rank'>
+            You are #{this.state.result.rank} on the leaderboard
+          </div>
+        ) : (
+          <form onSubmit={this.saveResult}>
+            <input
+              type='text'
+              name='player'
+              placeholder='Your name'
+              maxLength={64}
+              onChange={this.handleChange}
+            />
+            <input className='button' type='submit' value='Save Score' />
+          </form>
+        )}
         <div className='play-again button' onClick={this.restartGame}>
           Play Again?
         </div>
@@ -1,10 +1,19 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
+
+// Wait for a pause in typing before asking for suggestions.
+const suggestDelay = 150;
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
+  componentWillUnmount() {
+    clearTimeout(this.suggestTimer);
+  }
+
   getInfo = (event) => {
     event.preventDefault();
     this.props.submitSearch(this.state.query);
@@ -14,6 +23,30 @@ class Search extends Component {
     this.setState({
       query: this.search.value,
     });
+    clearTimeout(this.suggestTimer);
+    this.suggestTimer = setTimeout(this.getSuggestions, suggestDelay);
+  };
+
+  getSuggestions = () => {
+    const query = this.state.query;
+    if (!query.trim()) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    $.ajax({
+      url: `/questions/suggest?q=${encodeURIComponent(query)}&limit=8`, //TODO: update request URL
+      type: 'GET',
+      success: (result) => {
+        // Drop answers to keystrokes the user has already typed past.
+        if (result.success && query === this.state.query) {
+          this.setState({ suggestions: result.suggestions });
+        }
+        return;
+      },
+      error: (error) => {
+        return;
+      },
+    });
   };
 
   render() {
@@ -23,7 +56,14 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='search-suggestions'
+          autoComplete='off'
         />
+        <datalist id='search-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion} value={suggestion} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );